@@ -0,0 +1,194 @@
+#!/usr/bin/python
+
+"""End to end benchmarks against the in-process fake API server.
+
+Measures DataFrameQuery and sharded HuntResults rows/sec, VFSGetBuffer
+download MB/s and PushEvents events/sec over a real TLS gRPC channel
+(see pyvelociraptor.fake_server):
+
+$ python benchmarks/bench_api.py --rows 200000 --file_size 104857600 --latency 0.005
+
+With --profiles each transport profile (client.PROFILES) is compared
+instead, and with --tail downloads with and without hedged reads are
+compared while the server fails or delays some reads.
+"""
+import argparse
+import io
+import time
+
+import grpc
+
+from pyvelociraptor import client
+from pyvelociraptor import download
+from pyvelociraptor import fake_server
+from pyvelociraptor import hunts
+from pyvelociraptor import push_event
+from pyvelociraptor import velo_pandas
+
+
+def report(name, elapsed, count, unit):
+    print("%-40s %8.3fs %12.1f %s" % (name, elapsed, count / elapsed, unit))
+
+
+def bench_query(server, args):
+    start = time.perf_counter()
+    result = velo_pandas.DataFrameQuery("SELECT * FROM fake()",
+                                        config=server.config)
+    elapsed = time.perf_counter() - start
+
+    rows = len(next(iter(result.values())))
+    assert rows == args.rows, rows
+    report("DataFrameQuery", elapsed, rows, "rows/sec")
+
+
+def bench_hunt(server, args, shards, use_processes=False):
+    # The fake server returns all its rows for every shard.
+    flows = [dict(ClientId="C.%016x" % i, FlowId="F.%d" % i)
+             for i in range(shards)]
+
+    start = time.perf_counter()
+    result = hunts.HuntResults(None, "Fake", flows=flows, shards=shards,
+                               use_processes=use_processes,
+                               config=server.config)
+    elapsed = time.perf_counter() - start
+
+    rows = len(result["Pid"])
+    assert rows == args.rows * shards, rows
+    report("HuntResults (%d shards%s)" % (
+        shards, ", processes" if use_processes else ""),
+           elapsed, rows, "rows/sec")
+
+
+def bench_download(server, args, concurrency):
+    stub = client.GetClient(server.config).stub()
+    downloader = download.Downloader(stub, chunk_size=args.chunk_size,
+                                     concurrency=concurrency)
+
+    out = io.BytesIO()
+    start = time.perf_counter()
+    size = downloader.Fetch(["fake", "file"], out)
+    elapsed = time.perf_counter() - start
+
+    assert size == args.file_size, size
+    if args.verify:
+        assert out.getvalue() == fake_server.ExpectedData(0, size)
+
+    report("VFSGetBuffer (concurrency %d)" % concurrency,
+           elapsed, size / 1024 / 1024, "MB/sec")
+
+
+def bench_profiles(server, args):
+    # Each profile gets its own client and channel.
+    for name in client.PROFILES:
+        c = client.Client(server.config, profile=name)
+        try:
+            start = time.perf_counter()
+            result = velo_pandas.DataFrameQuery("SELECT * FROM fake()",
+                                                config=c)
+            report("DataFrameQuery [%s]" % name, time.perf_counter() - start,
+                   len(result["Pid"]), "rows/sec")
+
+            downloader = download.Downloader(
+                c.stub(), chunk_size=args.profile_chunk_size, concurrency=4)
+            start = time.perf_counter()
+            size = downloader.Fetch(["fake", "file"], io.BytesIO())
+            report("VFSGetBuffer %dMB chunks [%s]" % (
+                args.profile_chunk_size // 1024 // 1024, name),
+                   time.perf_counter() - start, size / 1024 / 1024, "MB/sec")
+
+        except grpc.RpcError as e:
+            print("%-40s failed: %s" % ("[%s]" % name, e.code()))
+
+        finally:
+            c.close()
+
+
+def bench_tail(server, args):
+    # Some reads fail and some are slow.
+    servicer = server.servicer
+    servicer.error_rate = args.error_rate
+    servicer.straggler_rate = args.straggler_rate
+    servicer.straggler_latency = args.straggler_latency
+
+    stub = client.GetClient(server.config).stub()
+    try:
+        for hedge_after in (None, args.hedge_after):
+            downloader = download.Downloader(
+                stub, chunk_size=args.chunk_size, concurrency=4,
+                hedge_after=hedge_after)
+
+            start = time.perf_counter()
+            size = downloader.Fetch(["fake", "file"], io.BytesIO())
+            report("VFSGetBuffer (hedge %s, %d retried, %d hedged)" % (
+                hedge_after, downloader.retried, downloader.hedged),
+                   time.perf_counter() - start, size / 1024 / 1024, "MB/sec")
+    finally:
+        servicer.error_rate = servicer.straggler_rate = 0
+
+
+def bench_push(server, args):
+    events = [dict(Time=i, Message="event %d" % i) for i in range(args.batch)]
+
+    start = time.perf_counter()
+    for _ in range(args.pushes):
+        push_event.run(server.config, "Server.Audit.Logs", "", "server",
+                       events, verbose=False)
+    elapsed = time.perf_counter() - start
+
+    report("PushEvents (%d per call)" % args.batch,
+           elapsed, args.pushes * args.batch, "events/sec")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the API entry points against a fake server.")
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--batch_size", type=int, default=1000)
+    parser.add_argument("--row_size", type=int, default=200)
+    parser.add_argument("--file_size", type=int, default=50 * 1024 * 1024)
+    parser.add_argument("--chunk_size", type=int,
+                        default=download.DEFAULT_CHUNK_SIZE)
+    parser.add_argument("--latency", type=float, default=0,
+                        help="Delay in seconds the server adds to every call.")
+    parser.add_argument("--pushes", type=int, default=200)
+    parser.add_argument("--batch", type=int, default=100,
+                        help="Events sent per PushEvents call.")
+    parser.add_argument("--verify", action="store_true",
+                        help="Check the downloaded data.")
+    parser.add_argument("--profiles", action="store_true",
+                        help="Only compare the transport profiles.")
+    parser.add_argument("--profile_chunk_size", type=int,
+                        default=8 * 1024 * 1024,
+                        help="Chunk size for the profile downloads.")
+    parser.add_argument("--tail", action="store_true",
+                        help="Only compare downloads with and without "
+                        "hedging against failing and slow reads.")
+    parser.add_argument("--error_rate", type=float, default=0.02)
+    parser.add_argument("--straggler_rate", type=float, default=0.05)
+    parser.add_argument("--straggler_latency", type=float, default=1)
+    parser.add_argument("--hedge_after", type=float, default=0.1)
+    args = parser.parse_args()
+
+    with fake_server.FakeServer(
+            rows=args.rows, batch_size=args.batch_size,
+            row_size=args.row_size, file_size=args.file_size,
+            latency=args.latency) as server:
+        if args.profiles:
+            bench_profiles(server, args)
+            return
+
+        if args.tail:
+            bench_tail(server, args)
+            return
+
+        bench_query(server, args)
+        for shards in (1, 4, 8):
+            bench_hunt(server, args, shards)
+        bench_hunt(server, args, 8, use_processes=True)
+        for concurrency in (1, 4, 8):
+            bench_download(server, args, concurrency)
+        bench_push(server, args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+#!/usr/bin/python
+
+"""Benchmark DataFrameQuery result assembly.
+
+This compares the columnar batch assembly in
+velo_pandas.ResponseColumns with the old per-row dict-of-lists
+loop, and the cost and memory savings of typed columns
+(velo_pandas.ConvertColumns). Responses are synthesized in memory so
+no server is needed. Both assembly strategies decode with the same
+JSON backend (see decoder.Backend()) so only the assembly differs:
+
+$ python benchmarks/bench_dataframe.py --rows 1000000 --batch 1000
+"""
+import argparse
+import json
+import time
+
+from pyvelociraptor import api_pb2
+from pyvelociraptor import decoder
+from pyvelociraptor import velo_pandas
+
+
+COLUMNS = ["ClientId", "Fqdn", "Pid", "Name", "CommandLine",
+           "CreateTime", "Details"]
+
+
+def make_responses(rows, batch):
+    responses = []
+    for start in range(0, rows, batch):
+        package = []
+        for i in range(start, min(start + batch, rows)):
+            package.append(dict(
+                ClientId="C.%016x" % (i % 5000),
+                Fqdn="host-%d.example.com" % (i % 5000),
+                Pid=i,
+                Name="svchost.exe",
+                CommandLine="C:\\Windows\\system32\\svchost.exe -k netsvcs -p",
+                CreateTime="2024-01-01T00:00:%02dZ" % (i % 60),
+                Details=dict(Username="NT AUTHORITY\\SYSTEM", Ppid=4,
+                             Hash=dict(MD5="d41d8cd98f00b204e9800998ecf8427e")),
+            ))
+
+        responses.append(api_pb2.VQLResponse(
+            Response=json.dumps(package), Columns=COLUMNS,
+            types=[api_pb2.VQLTypeMap(column="Pid", type="int"),
+                   api_pb2.VQLTypeMap(column="CreateTime", type="timestamp")],
+            total_rows=len(package)))
+
+    return responses
+
+
+def dict_of_lists(responses):
+    # The original DataFrameQuery assembly loop.
+    result = {}
+    for response in responses:
+        if not response.Response:
+            continue
+
+        for row in decoder.Loads(response.Response):
+            for c in response.Columns:
+                result.setdefault(c, []).append(row.get(c))
+
+    return result
+
+
+def bench(name, func, responses, rows, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(responses)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+
+    print("%-20s %10.3fs %12.0f rows/sec" % (name, best, rows / best))
+
+
+def typed_columns(responses):
+    types = {}
+    columns = velo_pandas.ResponseColumns(
+        velo_pandas.ResponseTypes(responses, types))
+    return velo_pandas.ConvertColumns(columns, types)
+
+
+def dataframe_memory(responses):
+    try:
+        import pandas
+    except ImportError:
+        return
+
+    for name, func in (("untyped", velo_pandas.ResponseColumns),
+                       ("typed", typed_columns)):
+        df = pandas.DataFrame(func(responses))
+        print("%-20s %10.1f MB DataFrame" % (
+            name, df.memory_usage(deep=True).sum() / 1024 / 1024))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark DataFrameQuery result assembly.")
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--batch", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    responses = make_responses(args.rows, args.batch)
+    print("JSON backend: %s" % decoder.Backend())
+    bench("dict-of-lists", dict_of_lists, responses, args.rows, args.repeat)
+    bench("columnar", velo_pandas.ResponseColumns, responses,
+          args.rows, args.repeat)
+    bench("columnar typed", typed_columns, responses, args.rows, args.repeat)
+    dataframe_memory(responses)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+#!/usr/bin/python
+
+"""Benchmark decoding of VQLResponse payloads.
+
+Decodes realistic nested VQL rows with each installed JSON backend
+(see pyvelociraptor.decoder):
+
+$ python benchmarks/bench_json.py --rows 200000
+"""
+import argparse
+import time
+
+from pyvelociraptor import decoder
+
+from bench_dataframe import make_responses
+
+
+def bench(name, responses, rows, repeat):
+    try:
+        decoder.SetBackend(name)
+    except ImportError:
+        print("%-10s not installed" % name)
+        return
+
+    size = sum(len(x.Response) for x in responses)
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for response in responses:
+            decoder.DecodeResponse(response)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+
+    print("%-10s %10.3fs %12.0f rows/sec %8.1f MB/sec" % (
+        name, best, rows / best, size / best / 1024 / 1024))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark decoding of VQLResponse payloads.")
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--batch", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    responses = make_responses(args.rows, args.batch)
+    for name in decoder.PREFERRED:
+        bench(name, responses, args.rows, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+#!/usr/bin/python
+
+"""Benchmark the memory held by decoded rows.
+
+Compares keeping every row as a dict (decoder.DecodeResponse) against
+compact Row records (decoder.DecodeRows), with and without sharing
+repeated strings:
+
+$ python benchmarks/bench_rows.py --rows 1000000
+"""
+import argparse
+import gc
+import time
+import tracemalloc
+
+from pyvelociraptor import decoder
+
+from bench_dataframe import make_responses
+
+
+def bench(name, decode, responses, rows):
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+
+    kept = []
+    for response in responses:
+        kept.extend(decode(response))
+
+    elapsed = time.perf_counter() - start
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    assert len(kept) == rows, len(kept)
+    print("%-12s %8.3fs %10.1f MB held %8.0f bytes/row" % (
+        name, elapsed, size / 1024 / 1024, size / rows))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the memory held by decoded rows.")
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--batch", type=int, default=1000)
+    args = parser.parse_args()
+
+    responses = make_responses(args.rows, args.batch)
+    bench("dicts", decoder.DecodeResponse, responses, args.rows)
+    bench("Row records", decoder.DecodeRows, responses, args.rows)
+
+    strings = {}
+    bench("shared strs", lambda response: decoder.DecodeRows(response, strings),
+          responses, args.rows)
+
+
+if __name__ == '__main__':
+    main()
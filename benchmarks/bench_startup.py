@@ -0,0 +1,66 @@
+#!/usr/bin/python
+
+"""Benchmark cold start cost of the command line entry points.
+
+For each console script this reports the median wall time of running
+`--help` in a fresh interpreter, and the cumulative import time of the
+entry point module (from python -X importtime):
+
+$ python benchmarks/bench_startup.py --repeat 10
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+
+
+ENTRY_POINTS = [
+    ("pyvelociraptor", "pyvelociraptor.client_example"),
+    ("pyvelociraptor_push_event", "pyvelociraptor.push_event"),
+    ("pyvelociraptor_fetch", "pyvelociraptor.fetch"),
+    ("pyvelociraptor_fetch_flow_uploads", "pyvelociraptor.fetch_flow_uploads"),
+]
+
+
+def help_time(module):
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-m", module, "--help"],
+                   stdout=subprocess.DEVNULL, check=True)
+    return time.perf_counter() - start
+
+
+def import_time(module):
+    res = subprocess.run([sys.executable, "-X", "importtime", "-c",
+                          "import " + module],
+                         stderr=subprocess.PIPE, check=True, text=True)
+
+    # Lines look like "import time: self | cumulative | name"
+    total = 0
+    for line in res.stderr.splitlines():
+        parts = line.split("|")
+        if len(parts) != 3 or not parts[1].strip().isdigit():
+            continue
+
+        # Only count top level imports.
+        if not parts[2].startswith("  "):
+            total += int(parts[1])
+
+    return total / 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark cold start cost of the entry points.")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print("%-36s %12s %12s" % ("entry point", "--help (s)", "import (s)"))
+    for name, module in ENTRY_POINTS:
+        help_s = statistics.median(help_time(module) for _ in range(args.repeat))
+        import_s = statistics.median(import_time(module) for _ in range(args.repeat))
+        print("%-36s %12.3f %12.3f" % (name, help_s, import_s))
+
+
+if __name__ == '__main__':
+    main()
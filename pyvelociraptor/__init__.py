@@ -1,24 +1,51 @@
-from cryptography.hazmat.primitives import serialization
-from cryptography.hazmat.backends import default_backend
-from cryptography.hazmat.primitives.serialization import load_pem_private_key
-
 import getpass
 import os
-import yaml
+import threading
+
+# yaml and cryptography are imported when needed so the command line
+# tools start quickly.
+
+# Parsed (and decrypted) configs keyed by path. Each entry holds the
+# file's mtime so an edited file is read again.
+_config_cache = {}
+_config_lock = threading.Lock()
 
-def LoadConfigFile(config_file=None, password=None, backend=default_backend()):
+def LoadConfigFile(config_file=None, password=None, backend=None):
     if config_file is None:
         config_file = os.environ.get("VELOCIRAPTOR_API_FILE")
 
     if config_file is None:
         config_file = os.path.join(os.environ.get("HOME"), ".pyvelociraptorrc")
 
+    path = os.path.abspath(config_file)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        mtime = None
+
+    with _config_lock:
+        cached = _config_cache.get(path)
+        if cached is not None and cached[0] == mtime:
+            return dict(cached[1])
+
+        config = _LoadConfigFile(config_file, backend)
+        if mtime is not None:
+            _config_cache[path] = (mtime, config)
+
+        return dict(config)
+
+def _LoadConfigFile(config_file, backend):
+    import yaml
+
     try:
         config = yaml.safe_load(open(config_file).read())
     except Exception as e:
         raise TypeError("Unable to parse config file from %s: %s" % (config_file, e))
 
     while "ENCRYPTED" in config["client_private_key"]:
+        from cryptography.hazmat.primitives import serialization
+        from cryptography.hazmat.primitives.serialization import load_pem_private_key
+
         try:
             password = getpass.getpass("Password: ").encode()
             pem = config["client_private_key"].encode("utf8")
@@ -0,0 +1,125 @@
+"""An asyncio client for the Velociraptor API.
+
+This is built on grpc.aio and allows many queries and downloads to
+run concurrently from a single event loop:
+
+```
+import asyncio
+from pyvelociraptor import aio
+
+async def main():
+    async with aio.AsyncClient() as c:
+        async for rows in c.Query("SELECT * FROM info()"):
+            print(rows)
+
+        data = await c.VFSGetBuffer(
+            ["downloads", "C.123", "F.123", "F.123.zip"], length=1024*1024)
+
+asyncio.run(main())
+```
+
+Credentials and options are built from the same API config as the
+synchronous client (see pyvelociraptor.LoadConfigFile).
+"""
+import json
+
+import grpc
+import grpc.aio
+
+import pyvelociraptor
+from pyvelociraptor import api_pb2
+from pyvelociraptor import api_pb2_grpc
+from pyvelociraptor import client
+from pyvelociraptor import decoder
+
+
+class AsyncClient:
+    """Keeps a warm grpc.aio channel to the server."""
+
+    def __init__(self, config=None, profile=None):
+        if config is None:
+            config = pyvelociraptor.LoadConfigFile()
+
+        self.config = config
+        self.credentials = client.ChannelCredentials(config)
+        self.options = client.ChannelOptions(config, profile)
+        self.compression = client.ChannelCompression(config, profile)
+        self._channel = None
+        self._stub = None
+
+    def stub(self):
+        # The aio channel binds to the running loop so we only open it
+        # on first use.
+        if self._stub is None:
+            self._channel = grpc.aio.secure_channel(
+                self.config["api_connection_string"],
+                self.credentials, self.options,
+                compression=self.compression)
+            self._stub = api_pb2_grpc.APIStub(self._channel)
+
+        return self._stub
+
+    async def QueryResponses(self, query, org_id=None, max_row=0,
+                             max_wait=1, timeout=0, **kw):
+        """Yields the raw VQLResponse messages for the query."""
+        request = api_pb2.VQLCollectorArgs(
+            org_id=org_id or "",
+            max_row=max_row,
+            max_wait=max_wait,
+            timeout=timeout,
+            env=[api_pb2.VQLEnv(key=k, value=v) for k,v in kw.items()],
+            Query=[api_pb2.VQLRequest(
+                Name="Query",
+                VQL=query,
+            )])
+
+        async for response in self.stub().Query(request):
+            yield response
+
+    async def Query(self, query, org_id=None, max_row=0,
+                    max_wait=1, timeout=0, **kw):
+        """Yields each batch of rows as a list of dicts.
+
+        Keyword args are passed to the query as env parameters.
+        """
+        async for response in self.QueryResponses(
+                query, org_id=org_id, max_row=max_row,
+                max_wait=max_wait, timeout=timeout, **kw):
+            if response.Response:
+                yield decoder.DecodeResponse(response)
+
+    async def VFSGetBuffer(self, components, offset=0,
+                           length=1024 * 1024, org_id=None):
+        """Reads a single buffer from the server's file store."""
+        res = await self.stub().VFSGetBuffer(api_pb2.VFSFileBuffer(
+            org_id=org_id or "",
+            components=components,
+            offset=offset,
+            length=length,
+        ))
+
+        return res.data
+
+    async def PushEvents(self, queue, rows, client_id="server", org_id=None):
+        """Sends the rows (a list of dicts) to the artifact queue."""
+        serialized = "".join(json.dumps(row) + "\n" for row in rows)
+
+        await self.stub().PushEvents(api_pb2.PushEventRequest(
+            artifact=queue,
+            client_id=client_id,
+            jsonl=serialized.encode("utf8"),
+            rows=len(rows),
+            org_id=org_id or "",
+        ))
+
+    async def close(self):
+        if self._channel is not None:
+            await self._channel.close()
+            self._channel = None
+            self._stub = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
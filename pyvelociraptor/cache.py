@@ -0,0 +1,132 @@
+"""A disk backed cache for query results.
+
+This is useful in notebooks where cells which query immutable data
+(e.g. hunt_results() of a finished hunt or source() of a completed
+flow) are re-run many times. The cache is opt in:
+
+```
+from pyvelociraptor import velo_pandas
+
+velo_pandas.EnableCache("~/.cache/pyvelociraptor", max_bytes=2 * 1024**3)
+
+# Runs on the server the first time, then comes from disk.
+df = pandas.DataFrame(velo_pandas.DataFrameQuery(query, HuntId=HuntId))
+```
+
+Results are keyed on the server, the query text, the env and the
+org_id. Each result is stored column-wise as compressed JSON. When the
+cache grows past max_bytes the least recently used results are
+evicted.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+import zlib
+
+
+class ResultCache:
+    """Stores query results (dicts of columns) on disk."""
+
+    SUFFIX = ".vqlcache"
+
+    def __init__(self, path="~/.cache/pyvelociraptor",
+                 max_bytes=1024 * 1024 * 1024, ttl=None):
+        self.path = os.path.expanduser(path)
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+
+        os.makedirs(self.path, exist_ok=True)
+
+    def Key(self, server, query, env, org_id):
+        data = json.dumps([server, query, sorted(env.items()), org_id or ""])
+        return hashlib.sha256(data.encode("utf8")).hexdigest()
+
+    def _filename(self, key):
+        return os.path.join(self.path, key + self.SUFFIX)
+
+    def Get(self, key):
+        """Returns the cached columns or None if missing or expired."""
+        entry = self.GetWithTypes(key)
+        if entry is None:
+            return None
+
+        return entry[0]
+
+    def GetWithTypes(self, key):
+        """Returns (columns, types) or None if missing or expired."""
+        filename = self._filename(key)
+        try:
+            with open(filename, "rb") as fd:
+                entry = json.loads(zlib.decompress(fd.read()))
+        except (OSError, ValueError, zlib.error):
+            return None
+
+        expires = entry.get("expires")
+        if expires is not None and expires < time.time():
+            self._remove(filename)
+            return None
+
+        # The access time drives the LRU eviction.
+        try:
+            os.utime(filename)
+        except OSError:
+            pass
+
+        return entry["columns"], entry.get("types") or {}
+
+    def Set(self, key, columns, ttl=None, types=None):
+        ttl = self.ttl if ttl is None else ttl
+        entry = dict(columns=columns, types=types or {},
+                     expires=ttl and time.time() + ttl or None)
+
+        data = zlib.compress(json.dumps(entry).encode("utf8"))
+        filename = self._filename(key)
+        tmp = "%s.%d.tmp" % (filename, threading.get_ident())
+        with open(tmp, "wb") as fd:
+            fd.write(data)
+        os.replace(tmp, filename)
+
+        self.Evict()
+
+    def Invalidate(self, key):
+        self._remove(self._filename(key))
+
+    def Clear(self):
+        for filename in self._entries():
+            self._remove(filename)
+
+    def Evict(self):
+        """Removes the least recently used entries until we fit in max_bytes."""
+        with self._lock:
+            entries = []
+            total = 0
+            for filename in self._entries():
+                try:
+                    st = os.stat(filename)
+                except OSError:
+                    continue
+
+                entries.append((st.st_mtime, st.st_size, filename))
+                total += st.st_size
+
+            entries.sort()
+            for _, size, filename in entries:
+                if total <= self.max_bytes:
+                    break
+
+                self._remove(filename)
+                total -= size
+
+    def _entries(self):
+        for name in os.listdir(self.path):
+            if name.endswith(self.SUFFIX):
+                yield os.path.join(self.path, name)
+
+    def _remove(self, filename):
+        try:
+            os.remove(filename)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,270 @@
+"""A reusable client session for the Velociraptor API.
+
+Building the channel credentials and opening a new gRPC channel costs
+a full TLS handshake. Rather than doing this for every query, create a
+Client once and reuse it for all calls:
+
+```
+import pyvelociraptor
+from pyvelociraptor import client
+
+config = pyvelociraptor.LoadConfigFile()
+with client.Client(config) as c:
+    for response in c.stub().Query(request):
+        ...
+```
+
+The helpers in this package (velo_pandas.DataFrameQuery, fetch.run
+etc) all call GetClient() which keeps one warm Client per API config
+for the life of the process. It is also possible to pass a Client
+instance anywhere a config is expected.
+
+The channel is tuned by a named transport profile (see PROFILES):
+interactive, bulk-download or long-lived-events. Set it for every
+call in the API config file:
+
+```
+transport_profile: bulk-download
+transport_compression: gzip          # optional
+transport_options:                   # optional raw gRPC channel options
+  grpc.keepalive_time_ms: 600000
+```
+
+or for some calls by passing a client made with a profile as the
+config, e.g. GetClient(config, profile="interactive").
+"""
+import itertools
+import threading
+
+import pyvelociraptor
+from pyvelociraptor import lazy
+
+grpc = lazy.Import("grpc")
+api_pb2_grpc = lazy.Import("pyvelociraptor.api_pb2_grpc")
+
+
+_credentials = {}
+_credentials_lock = threading.Lock()
+
+
+def ChannelCredentials(config):
+    """Builds the gRPC channel credentials from the API config.
+
+    Credentials are built once per process for each set of keys.
+    """
+    key = (config["ca_certificate"],
+           config["client_private_key"],
+           config["client_cert"])
+
+    with _credentials_lock:
+        creds = _credentials.get(key)
+        if creds is None:
+            # Fill in the SSL params from the api_client config file. You can
+            # get such a file:
+            # velociraptor --config server.config.yaml config api_client > api_client.conf.yaml
+            creds = _credentials[key] = grpc.ssl_channel_credentials(
+                root_certificates=config["ca_certificate"].encode("utf8"),
+                private_key=config["client_private_key"].encode("utf8"),
+                certificate_chain=config["client_cert"].encode("utf8"))
+
+        return creds
+
+
+# Named transport profiles. Each has gRPC channel options and the
+# compression used for the messages we send ("gzip", "deflate" or
+# None).
+#
+# Keepalive pings are sent no more often than every 5 minutes, since
+# gRPC servers by default drop connections which ping more often.
+PROFILES = {
+    # The plain channel the API has always used.
+    "default": dict(options={}, compression=None),
+
+    # Notebooks and short queries: allow large response batches and
+    # reconnect quickly after the connection was dropped while idle.
+    "interactive": dict(options={
+        "grpc.max_receive_message_length": 64 * 1024 * 1024,
+        "grpc.initial_reconnect_backoff_ms": 500,
+        "grpc.max_reconnect_backoff_ms": 5000,
+    }, compression=None),
+
+    # VFSGetBuffer and large exports: big messages and large HTTP/2
+    # flow control windows so the server is not throttled by the
+    # window on high latency links.
+    "bulk-download": dict(options={
+        "grpc.max_receive_message_length": 256 * 1024 * 1024,
+        "grpc.http2.lookahead_bytes": 16 * 1024 * 1024,
+        "grpc.http2.max_frame_size": 16 * 1024 * 1024 - 1,
+        "grpc.http2.bdp_probe": 1,
+    }, compression=None),
+
+    # Event queries (watch_monitoring) which run for days: keepalives
+    # detect dead connections and keep NAT and load balancer state
+    # alive.
+    "long-lived-events": dict(options={
+        "grpc.max_receive_message_length": 64 * 1024 * 1024,
+        "grpc.keepalive_time_ms": 300000,
+        "grpc.keepalive_timeout_ms": 20000,
+        "grpc.http2.max_pings_without_data": 0,
+        "grpc.max_reconnect_backoff_ms": 30000,
+    }, compression=None),
+}
+
+
+def _Profile(config, profile=None):
+    """Resolves the transport settings for a config.
+
+    The profile is taken from the argument, or the config's
+    transport_profile. The config's transport_options and
+    transport_compression override the profile's settings.
+    """
+    name = profile or config.get("transport_profile") or "default"
+    try:
+        settings = PROFILES[name]
+    except KeyError:
+        raise ValueError("Unknown transport profile %s. Known profiles: %s" % (
+            name, ", ".join(PROFILES)))
+
+    options = dict(settings["options"])
+    options.update(config.get("transport_options") or {})
+
+    compression = config.get("transport_compression", settings["compression"])
+    return name, options, compression
+
+
+def ChannelOptions(config, profile=None):
+    """Returns the channel options used to connect to the server."""
+    _, options, _ = _Profile(config, profile)
+
+    # This option is required to connect to the grpc server by IP - we
+    # use self signed certs.
+    return (('grpc.ssl_target_name_override', "VelociraptorServer",),) + \
+        tuple(sorted(options.items()))
+
+
+def ChannelCompression(config, profile=None):
+    """Returns the grpc.Compression to use for sent messages, or None."""
+    _, _, compression = _Profile(config, profile)
+    if not compression or compression == "none":
+        return None
+
+    return {"gzip": grpc.Compression.Gzip,
+            "deflate": grpc.Compression.Deflate}[compression]
+
+
+_interceptors = []
+
+
+def AddInterceptor(interceptor):
+    """Adds a gRPC client interceptor to channels opened from now on."""
+    _interceptors.append(interceptor)
+
+
+class Client:
+    """Holds the credentials and a small pool of warm channels."""
+
+    def __init__(self, config, pool_size=1, profile=None):
+        self.config = config
+        self.pool_size = max(1, pool_size)
+
+        self.profile = _Profile(config, profile)[0]
+        self.credentials = ChannelCredentials(config)
+        self.options = ChannelOptions(config, profile)
+        self.compression = ChannelCompression(config, profile)
+
+        self._lock = threading.Lock()
+        self._channels = []
+        self._stubs = []
+        self._next = itertools.count()
+
+    def _open(self):
+        channel = grpc.secure_channel(self.config["api_connection_string"],
+                                      self.credentials, self.options,
+                                      compression=self.compression)
+        self._channels.append(channel)
+
+        # The stub goes through the interceptors, close() still uses
+        # the underlying channel.
+        if _interceptors:
+            channel = grpc.intercept_channel(channel, *_interceptors)
+        self._stubs.append(api_pb2_grpc.APIStub(channel))
+
+    def channel(self):
+        """Returns the next channel from the pool, opening it if needed."""
+        return self._channels[self._pick()]
+
+    def stub(self):
+        """Returns an APIStub bound to the next channel in the pool."""
+        return self._stubs[self._pick()]
+
+    def _pick(self):
+        with self._lock:
+            idx = next(self._next) % self.pool_size
+            while len(self._channels) <= idx:
+                self._open()
+
+            return idx
+
+    def close(self):
+        with self._lock:
+            for channel in self._channels:
+                channel.close()
+
+            self._channels = []
+            self._stubs = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def _config_key(config, profile):
+    name, options, compression = _Profile(config, profile)
+    return (config["api_connection_string"],
+            config["ca_certificate"],
+            config["client_cert"],
+            config["client_private_key"],
+            name, tuple(sorted(options.items())), compression)
+
+
+def GetClient(config=None, pool_size=1, profile=None, default_profile=None):
+    """Returns a shared Client for this config.
+
+    Clients are cached per API config and transport profile so repeated
+    calls reuse the same warm channels. If config is already a Client
+    it is returned as is.
+
+    default_profile is used when neither profile nor the config's
+    transport_profile is set.
+    """
+    if isinstance(config, Client):
+        return config
+
+    if config is None:
+        config = pyvelociraptor.LoadConfigFile()
+
+    profile = profile or config.get("transport_profile") or default_profile
+
+    key = _config_key(config, profile)
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            client = _clients[key] = Client(config, pool_size=pool_size,
+                                            profile=profile)
+
+        return client
+
+
+def CloseClients():
+    """Closes all the shared clients."""
+    with _clients_lock:
+        for client in _clients.values():
+            client.close()
+
+        _clients.clear()
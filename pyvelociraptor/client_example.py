@@ -32,78 +32,93 @@ python script will block until psexec is detected.
 
 """
 import argparse
-import json
-import grpc
 import time
-import yaml
 
 import pyvelociraptor
-from pyvelociraptor import api_pb2
-from pyvelociraptor import api_pb2_grpc
+from pyvelociraptor import client
+from pyvelociraptor import decoder
+from pyvelociraptor import lazy
+from pyvelociraptor import replay
+from pyvelociraptor import sinks
+from pyvelociraptor import telemetry
 
+api_pb2 = lazy.Import("pyvelociraptor.api_pb2")
 
-def run(config, query, env_dict, org_id, timeout=0):
-    # Fill in the SSL params from the api_client config file. You can get such a file:
-    # velociraptor --config server.config.yaml config api_client > api_client.conf.yaml
-    creds = grpc.ssl_channel_credentials(
-        root_certificates=config["ca_certificate"].encode("utf8"),
-        private_key=config["client_private_key"].encode("utf8"),
-        certificate_chain=config["client_cert"].encode("utf8"))
 
-    # This option is required to connect to the grpc server by IP - we
-    # use self signed certs.
-    options = (('grpc.ssl_target_name_override', "VelociraptorServer",),)
+def run(config, query, env_dict, org_id, timeout=0, output=None,
+        format=None, max_rows=None, max_bytes=None, profile=None):
+    # Several queries may be sent in the same request. Each response
+    # names the query it belongs to.
+    queries = [query] if isinstance(query, str) else list(query)
 
     env = []
     for k, v in env_dict.items():
         env.append(dict(key=k, value=v))
 
-    # The first step is to open a gRPC channel to the server..
-    with grpc.secure_channel(config["api_connection_string"],
-                             creds, options) as channel:
-        stub = api_pb2_grpc.APIStub(channel)
-
-        # The request consists of one or more VQL queries. Note that
-        # you can collect artifacts by simply naming them using the
-        # "Artifact" plugin.
-        request = api_pb2.VQLCollectorArgs(
-            org_id=org_id,
-            max_wait=1,
-            max_row=100,
-            timeout=timeout,
-            Query=[api_pb2.VQLRequest(
-                Name="Test",
-                VQL=query,
-            )],
-            env=env,
-        )
-
-        # This will block as responses are streamed from the
-        # server. If the query is an event query we will run this loop
-        # forever.
-        for response in stub.Query(request):
-            if response.Response:
-                # Each response represents a list of rows. The columns
-                # are provided in their own field as an array, to
-                # ensure column order is preserved if required. If you
-                # dont care about column order just ignore the Columns
-                # field. Note that although JSON does not specify the
-                # order of keys in a dict Velociraptor always
-                # maintains this order so an alternative to the
-                # Columns field is to use a JSON parser that preserves
-                # field ordering.
-
-                # print("Columns %s:" % response.Columns)
-
-                # The actual payload is a list of dicts. Each dict has
-                # column names as keys and arbitrary (possibly nested)
-                # values.
-                package = json.loads(response.Response)
+    # The client keeps a warm channel to the server which is
+    # reused between calls.
+    stub = client.GetClient(config, profile=profile).stub()
+
+    # The request consists of one or more VQL queries. Note that
+    # you can collect artifacts by simply naming them using the
+    # "Artifact" plugin.
+    request = api_pb2.VQLCollectorArgs(
+        org_id=org_id,
+        max_wait=1,
+        max_row=100,
+        timeout=timeout,
+        Query=[api_pb2.VQLRequest(
+            Name="Query%d" % idx if len(queries) > 1 else "Test",
+            VQL=vql,
+        ) for idx, vql in enumerate(queries)],
+        env=env,
+    )
+
+    # Results may be streamed straight into files instead of being
+    # printed.
+    if output:
+        with sinks.Open(output, format=format, max_rows=max_rows,
+                        max_bytes=max_bytes) as sink:
+            for response in stub.Query(request):
+                if response.Response:
+                    sink.WriteResponse(response)
+
+                elif response.log:
+                    print ("%s: %s" % (time.ctime(response.timestamp / 1000000), response.log))
+
+        print ("Wrote %d rows to %s" % (sink.total_rows, ", ".join(sink.files)))
+        return
+
+    # This will block as responses are streamed from the
+    # server. If the query is an event query we will run this loop
+    # forever.
+    for response in stub.Query(request):
+        if response.Response:
+            # Each response represents a list of rows. The columns
+            # are provided in their own field as an array, to
+            # ensure column order is preserved if required. If you
+            # dont care about column order just ignore the Columns
+            # field. Note that although JSON does not specify the
+            # order of keys in a dict Velociraptor always
+            # maintains this order so an alternative to the
+            # Columns field is to use a JSON parser that preserves
+            # field ordering.
+
+            # print("Columns %s:" % response.Columns)
+
+            # The actual payload is a list of dicts. Each dict has
+            # column names as keys and arbitrary (possibly nested)
+            # values. DecodeRows() stores each row compactly as a
+            # tuple which still prints and reads like a dict.
+            package = decoder.DecodeRows(response)
+            if len(queries) > 1:
+                print ("%s: %s" % (response.Query.Name, package))
+            else:
                 print (package)
 
-            elif response.log:
-                # Query execution logs are sent in their own messages.
-                print ("%s: %s" % (time.ctime(response.timestamp / 1000000), response.log))
+        elif response.log:
+            # Query execution logs are sent in their own messages.
+            print ("%s: %s" % (time.ctime(response.timestamp / 1000000), response.log))
 
 class kwargs_append_action(argparse.Action):
     def __call__(self, parser, args, values, option_string=None):
@@ -139,12 +154,49 @@ def main():
                         metavar="KEY=VALUE",
                         help="Add query environment values in the form of Key=Value.")
 
-    parser.add_argument('query', type=str, help='The query to run.')
+    parser.add_argument("--output", type=str,
+                        help="Write the results to this file instead of printing them.")
+
+    parser.add_argument("--format", type=str, choices=list(sinks.FORMATS),
+                        help="The output format (default from the --output extension).")
+
+    parser.add_argument("--max_rows", type=int,
+                        help="Start a new output file after this many rows.")
+
+    parser.add_argument("--max_bytes", type=int,
+                        help="Start a new output file after this many bytes.")
+
+    parser.add_argument("--record", type=str,
+                        help="Record the raw responses to this file.")
+
+    parser.add_argument("--replay", type=str,
+                        help="Replay the responses recorded in this file "
+                        "instead of querying the server.")
+
+    parser.add_argument("--profile", type=str, choices=list(client.PROFILES),
+                        help="The transport profile (default from the API config).")
+
+    parser.add_argument("--stats", action="store_true",
+                        help="Print API call statistics to stderr when done.")
+
+    parser.add_argument('query', type=str, nargs='+',
+                        help='The query to run. Several queries are sent '
+                        'in a single request.')
 
     args = parser.parse_args()
 
-    config = pyvelociraptor.LoadConfigFile(args.config)
-    run(config, args.query, args.env, args.org, args.timeout)
+    if args.replay:
+        config = replay.ReplayClient(args.replay)
+    else:
+        config = pyvelociraptor.LoadConfigFile(args.config)
+        if args.record:
+            config = replay.RecordingClient(args.record, config)
+
+    with telemetry.PrintSummary(args.stats):
+        run(config, args.query, args.env, args.org, args.timeout,
+            output=args.output, format=args.format,
+            max_rows=args.max_rows, max_bytes=args.max_bytes,
+            profile=args.profile)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,245 @@
+"""Decoding of VQLResponse payloads.
+
+Each VQLResponse carries its rows as a JSON encoded list of dicts. On
+large result sets decoding this JSON is the dominant CPU cost, so we
+use a faster JSON library if one is installed:
+
+1. orjson (pip install orjson)
+2. pysimdjson (pip install pysimdjson)
+3. The standard library json module.
+
+The backend is picked on first use. It can be forced with the
+PYVELOCIRAPTOR_JSON environment variable or SetBackend().
+
+DecodeResponse() returns a dict per row, repeating the column names in
+every row. Consumers which keep many rows can use DecodeRows() instead,
+which returns compact tuple based Row records sharing one class per
+set of columns.
+"""
+import json
+import keyword
+import operator
+import os
+import time
+
+
+def _orjson():
+    import orjson
+
+    def loads(data):
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            # orjson is stricter than the standard library (e.g. it
+            # rejects NaN and Infinity) so fall back rather than fail.
+            # Note that integers outside the 64 bit range (which Go
+            # never produces) are decoded as floats.
+            return json.loads(data)
+
+    return loads
+
+
+def _simdjson():
+    import simdjson
+
+    return simdjson.loads
+
+
+def _stdlib():
+    return json.loads
+
+
+BACKENDS = {
+    "orjson": _orjson,
+    "simdjson": _simdjson,
+    "json": _stdlib,
+}
+
+# The order we try the backends in.
+PREFERRED = ["orjson", "simdjson", "json"]
+
+_backend = None
+_loads = None
+_observer = None
+
+
+def SetBackend(name=None):
+    """Selects the JSON backend by name or the fastest available if None.
+
+    Raises ImportError if the named backend is not installed.
+    """
+    global _backend, _loads
+
+    if name is not None:
+        if name not in BACKENDS:
+            raise ValueError("Unknown JSON backend %s. Known backends: %s" % (
+                name, ", ".join(BACKENDS)))
+
+        _loads = BACKENDS[name]()
+        _backend = name
+        return name
+
+    for candidate in PREFERRED:
+        try:
+            _loads = BACKENDS[candidate]()
+            _backend = candidate
+            return candidate
+        except ImportError:
+            continue
+
+
+def Backend():
+    """Returns the name of the JSON backend in use."""
+    if _backend is None:
+        SetBackend(os.environ.get("PYVELOCIRAPTOR_JSON") or None)
+
+    return _backend
+
+
+def Loads(data):
+    """Decodes JSON from str or bytes."""
+    if _loads is None:
+        Backend()
+
+    return _loads(data)
+
+
+def SetObserver(observer):
+    """Calls observer(response, seconds) after each DecodeResponse().
+
+    Used by the telemetry module. Pass None to remove the observer.
+    """
+    global _observer
+    _observer = observer
+
+
+def DecodeResponse(response):
+    """Returns the rows in a VQLResponse as a list of dicts."""
+    if not response.Response:
+        return []
+
+    if _observer is None:
+        return Loads(response.Response)
+
+    start = time.perf_counter()
+    rows = Loads(response.Response)
+    _observer(response, time.perf_counter() - start)
+    return rows
+
+
+class Row(tuple):
+    """A compact, read only row of a query result.
+
+    Values are stored in a tuple in column order. They can be read by
+    column name (row["Name"] or row.get("Name")), by position, or as
+    attributes when the column name is a valid identifier. Like a tuple,
+    iterating a row yields its values - use keys() for the column names.
+    """
+
+    __slots__ = ()
+
+    _fields = ()
+    _index = {}
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return tuple.__getitem__(self, self._index[key])
+
+        return tuple.__getitem__(self, key)
+
+    def get(self, key, default=None):
+        idx = self._index.get(key)
+        if idx is None:
+            return default
+
+        return tuple.__getitem__(self, idx)
+
+    def keys(self):
+        return self._fields
+
+    def items(self):
+        return zip(self._fields, self)
+
+    def _asdict(self):
+        return dict(zip(self._fields, self))
+
+    def __repr__(self):
+        # Print like the dict it replaces.
+        return repr(self._asdict())
+
+    def __reduce__(self):
+        # Row classes are made on the fly so pickle by columns.
+        return _NewRow, (self._fields, tuple(self))
+
+
+_row_classes = {}
+
+
+def RowClass(columns):
+    """Returns the Row subclass for these columns, creating it once."""
+    columns = tuple(columns)
+    cls = _row_classes.get(columns)
+    if cls is None:
+        attrs = dict(__slots__=(), _fields=columns,
+                     _index={c: idx for idx, c in enumerate(columns)})
+
+        for idx, c in enumerate(columns):
+            if (c.isidentifier() and not keyword.iskeyword(c)
+                and not hasattr(Row, c)):
+                attrs[c] = property(operator.itemgetter(idx))
+
+        cls = _row_classes[columns] = type("Row", (Row,), attrs)
+
+    return cls
+
+
+def _NewRow(columns, values):
+    return tuple.__new__(RowClass(columns), values)
+
+
+# Longer strings are rarely repeated and not worth sharing.
+MAX_SHARED_STRING = 256
+
+
+def _Share(value, strings):
+    cls = value.__class__
+    if cls is str:
+        if len(value) > MAX_SHARED_STRING:
+            return value
+        return strings.setdefault(value, value)
+
+    if cls is dict:
+        return {strings.setdefault(k, k): _Share(v, strings)
+                for k, v in value.items()}
+
+    if cls is list:
+        return [_Share(v, strings) for v in value]
+
+    return value
+
+
+def DecodeRows(response, strings=None):
+    """Returns the rows in a VQLResponse as a list of Row records.
+
+    The columns are taken from response.Columns (or the first row if it
+    is empty). Values of keys which are not listed in Columns are
+    dropped.
+
+    If strings is a dict, equal string values (including those nested
+    in dicts and lists) are shared through it, so values repeated
+    across rows (host names, paths, usernames) are only stored
+    once. Pass the same dict for every response of a query.
+    """
+    rows = DecodeResponse(response)
+    if not rows:
+        return []
+
+    columns = list(response.Columns) or list(rows[0])
+    cls = RowClass(columns)
+    new = tuple.__new__
+
+    if strings is None:
+        return [new(cls, [row.get(c) for c in columns]) for row in rows]
+
+    return [new(cls, [_Share(row.get(c), strings) for c in columns])
+            for row in rows]
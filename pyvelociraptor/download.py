@@ -0,0 +1,427 @@
+"""Fast downloads from the server's file store.
+
+The VFSGetBuffer API reads a single buffer at a given offset. Reading
+a file one chunk at a time limits throughput to chunk_size / RTT, so
+the Downloader keeps several chunk reads in flight at once over the
+shared channel and writes them to the output as they arrive.
+
+```
+from pyvelociraptor import client, download
+
+stub = client.GetClient(config).stub()
+with open("out.zip", "wb") as outfd:
+    download.Downloader(stub, concurrency=8).Fetch(components, outfd)
+```
+
+Chunk reads are plain offset/length reads, so they are safe to repeat.
+Each read has a deadline and transient failures are retried with
+jittered exponential backoff. With hedge_after set, a read which has
+not completed after that many seconds is sent again and the first
+reply wins, so a single slow read does not hold up the whole file.
+"""
+import concurrent.futures
+import hashlib
+import json
+import os
+import queue
+import random
+import threading
+import time
+
+from pyvelociraptor import lazy
+
+grpc = lazy.Import("grpc")
+api_pb2 = lazy.Import("pyvelociraptor.api_pb2")
+
+
+# This should be between 1 mb to 4mb for optimum performance.
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+
+DEFAULT_CONCURRENCY = 4
+
+# Seconds allowed for a single chunk read.
+DEFAULT_DEADLINE = 60
+
+DEFAULT_RETRIES = 3
+
+# Failures which may succeed when tried again. The server reports
+# plain errors (e.g. a missing file) as UNKNOWN, so that is not
+# retried.
+RETRY_CODES = {"UNAVAILABLE", "DEADLINE_EXCEEDED", "RESOURCE_EXHAUSTED",
+               "ABORTED"}
+
+
+class _Writer:
+    """Writes chunks which may arrive out of order.
+
+    If the output supports it we use positional writes, otherwise the
+    chunks are held until they can be written in order. Either way
+    next_offset tracks the point below which everything is written.
+    """
+
+    def __init__(self, outfd, offset, positional=None, checkpoint=None):
+        if positional is None:
+            positional = hasattr(os, "pwrite") and _seekable(outfd)
+
+        self.outfd = outfd
+        self.positional = positional
+        self.checkpoint = checkpoint
+        self.next_offset = offset
+        self.pending = {}
+        if positional:
+            # Anything already buffered must reach the file before we
+            # write around the file object.
+            outfd.flush()
+
+    def write(self, offset, data):
+        if self.positional:
+            fd = self.outfd.fileno()
+            self.pending[offset] = len(data)
+            while data:
+                n = os.pwrite(fd, data, offset)
+                data = data[n:]
+                offset += n
+
+            while self.next_offset in self.pending:
+                self.next_offset += self.pending.pop(self.next_offset)
+
+        else:
+            self.pending[offset] = data
+            while self.next_offset in self.pending:
+                data = self.pending.pop(self.next_offset)
+                self.outfd.write(data)
+                self.next_offset += len(data)
+
+        if self.checkpoint is not None:
+            self.checkpoint.Update(self.outfd, self.next_offset)
+
+
+def _seekable(outfd):
+    try:
+        outfd.fileno()
+        return outfd.seekable() and "a" not in getattr(outfd, "mode", "")
+    except (AttributeError, OSError, ValueError):
+        return False
+
+
+class Downloader:
+    """Downloads files from the server using concurrent ranged reads."""
+
+    def __init__(self, stub, org_id=None, chunk_size=DEFAULT_CHUNK_SIZE,
+                 concurrency=DEFAULT_CONCURRENCY, deadline=DEFAULT_DEADLINE,
+                 retries=DEFAULT_RETRIES, min_backoff=0.2, max_backoff=10,
+                 hedge_after=None, retry_codes=RETRY_CODES):
+        self.stub = stub
+        self.org_id = org_id or ""
+        self.chunk_size = chunk_size
+        self.concurrency = max(1, concurrency)
+        self.deadline = deadline
+        self.retries = retries
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.hedge_after = hedge_after
+        self.retry_codes = set(retry_codes)
+
+        self.retried = 0
+        self.hedged = 0
+
+        # Bytes read from the server by this downloader.
+        self.bytes_read = 0
+        self._lock = threading.Lock()
+
+    def ReadChunk(self, components, offset):
+        """Reads a single chunk at offset. Returns the data.
+
+        Failures with a status in self.retry_codes are retried up to
+        self.retries times.
+        """
+        attempt = 0
+        while True:
+            try:
+                data = self._Read(components, offset)
+                with self._lock:
+                    self.bytes_read += len(data)
+                return data
+
+            except grpc.RpcError as e:
+                if attempt >= self.retries or e.code().name not in self.retry_codes:
+                    raise
+
+            # Jitter spreads out the retries of reads which failed
+            # together.
+            backoff = min(self.max_backoff, self.min_backoff * 2 ** attempt)
+            time.sleep(backoff * (0.5 + random.random() / 2))
+            attempt += 1
+            with self._lock:
+                self.retried += 1
+
+    def _Read(self, components, offset):
+        request = api_pb2.VFSFileBuffer(
+            org_id=self.org_id,
+
+            # Paths must be given as separate components (they may
+            # contain / themselves).
+            components=components,
+            length=self.chunk_size,
+            offset=offset,
+        )
+
+        if not self.hedge_after:
+            return self.stub.VFSGetBuffer(request, timeout=self.deadline).data
+
+        done = queue.Queue()
+        calls = [self.stub.VFSGetBuffer.future(request, timeout=self.deadline)]
+        calls[0].add_done_callback(done.put)
+        try:
+            try:
+                call = done.get(timeout=self.hedge_after)
+            except queue.Empty:
+                # Still waiting - send the same read again.
+                with self._lock:
+                    self.hedged += 1
+                calls.append(self.stub.VFSGetBuffer.future(
+                    request, timeout=self.deadline))
+                calls[1].add_done_callback(done.put)
+                call = done.get()
+
+            # If the first reply is an error wait for the other one.
+            if call.exception() is not None and len(calls) > 1:
+                call = done.get()
+
+            return call.result().data
+
+        finally:
+            for call in calls:
+                call.cancel()
+
+    def Fetch(self, components, outfd, offset=0, size=None, positional=None,
+              checkpoint=None):
+        """Fetches the file into outfd starting at offset.
+
+        If size is known no reads are issued past it. Returns the
+        offset of the end of the file. If a Checkpoint is given it is
+        updated as the contiguous written range grows.
+        """
+        writer = _Writer(outfd, offset, positional=positional,
+                         checkpoint=checkpoint)
+        try:
+            return self._Fetch(components, writer, offset, size)
+
+        except BaseException:
+            # Checkpoints are only saved now and then, so record how
+            # far we got - a resumed download then only fetches the
+            # missing bytes.
+            if checkpoint is not None:
+                checkpoint.Update(outfd, writer.next_offset, force=True)
+            raise
+
+    def _Fetch(self, components, writer, offset, size):
+        # The first chunk is always read on its own - small files are
+        # done after this single round trip.
+        data = self.ReadChunk(components, offset)
+        writer.write(offset, data)
+        offset += len(data)
+        if size is not None and offset >= size:
+            return offset
+
+        if len(data) < self.chunk_size or self.concurrency == 1:
+            return self._FetchSequential(components, writer, offset, data)
+
+        eof = size
+        next_offset = offset
+        pending = {}
+
+        # Chunks written in order are held in memory until the gap
+        # before them is filled, so do not read too far ahead of a
+        # slow chunk.
+        window = None
+        if not writer.positional:
+            window = 2 * self.concurrency * self.chunk_size
+
+        with concurrent.futures.ThreadPoolExecutor(self.concurrency) as pool:
+            def fill():
+                nonlocal next_offset
+                while (len(pending) < self.concurrency and
+                       (eof is None or next_offset < eof) and
+                       (window is None or
+                        next_offset - writer.next_offset < window)):
+                    future = pool.submit(self.ReadChunk, components, next_offset)
+                    pending[future] = next_offset
+                    next_offset += self.chunk_size
+
+            try:
+                fill()
+                while pending:
+                    done, _ = concurrent.futures.wait(
+                        pending, return_when=concurrent.futures.FIRST_COMPLETED)
+
+                    for future in done:
+                        chunk_offset = pending.pop(future)
+                        data = future.result()
+                        if data:
+                            writer.write(chunk_offset, data)
+
+                        # A short read marks the end of the file.
+                        if len(data) < self.chunk_size:
+                            end = chunk_offset + len(data)
+                            if eof is None or end < eof:
+                                eof = end
+
+                    fill()
+
+            except BaseException:
+                for future in pending:
+                    future.cancel()
+                raise
+
+        return eof
+
+    def _FetchSequential(self, components, writer, offset, data):
+        while len(data) == self.chunk_size:
+            data = self.ReadChunk(components, offset)
+            writer.write(offset, data)
+            offset += len(data)
+
+        return offset
+
+
+class Checkpoint:
+    """Records the progress of a download in a sidecar file.
+
+    The sidecar sits next to the output file and stores the offset
+    below which all the data is known to be on disk. An interrupted
+    download can continue from this offset, and a completed download
+    is marked so it can be skipped next time.
+    """
+
+    SUFFIX = ".progress"
+
+    def __init__(self, output_file, components, interval=1):
+        self.path = output_file + self.SUFFIX
+        self.components = list(components)
+        self.interval = interval
+        self.offset = 0
+        self.complete = False
+        self.size = None
+        self.sha256 = None
+        self._last = 0
+
+        try:
+            with open(self.path) as fd:
+                state = json.load(fd)
+        except (OSError, ValueError):
+            return
+
+        # Only trust a sidecar written for the same file.
+        if state.get("components") != self.components:
+            return
+
+        self.offset = state.get("offset", 0)
+        self.complete = state.get("complete", False)
+        self.size = state.get("size")
+        self.sha256 = state.get("sha256")
+
+    def Update(self, outfd, offset, force=False):
+        now = time.time()
+        if not force and now - self._last < self.interval:
+            return
+
+        # Make sure the data is on disk before we record it.
+        outfd.flush()
+        os.fsync(outfd.fileno())
+
+        self.offset = offset
+        self._last = now
+        self.Save()
+
+    def Save(self):
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as fd:
+            json.dump(dict(components=self.components,
+                           offset=self.offset,
+                           complete=self.complete,
+                           size=self.size,
+                           sha256=self.sha256), fd)
+        os.replace(tmp, self.path)
+
+    def Remove(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+def _FileSha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as fd:
+        for data in iter(lambda: fd.read(DEFAULT_CHUNK_SIZE), b""):
+            h.update(data)
+
+    return h.hexdigest()
+
+
+def _Matches(path, size, sha256):
+    try:
+        if size is not None and os.path.getsize(path) != size:
+            return False
+    except OSError:
+        return False
+
+    return not sha256 or _FileSha256(path) == sha256.lower()
+
+
+def FetchResumable(downloader, components, output_file, size=None, sha256=None):
+    """Fetches the file into output_file, resuming a previous attempt.
+
+    Files which are already complete (and match size and sha256 if
+    given) are skipped. A complete file of a different size than the
+    server reports is fetched again. Returns a tuple of the file size and whether
+    it was skipped. Raises IOError if the finished file does not
+    match the expected size or hash.
+    """
+    checkpoint = Checkpoint(output_file, components)
+    exists = os.path.exists(output_file)
+
+    if (exists and checkpoint.complete and
+            (size is None or size == checkpoint.size) and
+            _Matches(output_file, checkpoint.size, sha256)):
+        return checkpoint.size, True
+
+    # Without a sidecar we can only skip the file if the server told
+    # us what it should look like.
+    if (exists and not os.path.exists(checkpoint.path) and
+            size is not None and _Matches(output_file, size, sha256)):
+        checkpoint.complete = True
+        checkpoint.offset = checkpoint.size = size
+        checkpoint.sha256 = sha256
+        checkpoint.Save()
+        return size, True
+
+    offset = checkpoint.offset if exists and not checkpoint.complete else 0
+    if exists and os.path.getsize(output_file) < offset:
+        offset = 0
+
+    with open(output_file, "r+b" if offset else "wb") as outfd:
+        # Anything past the last checkpoint was not verified.
+        outfd.truncate(offset)
+        outfd.seek(offset)
+
+        checkpoint.offset = offset
+        checkpoint.complete = False
+        checkpoint.Save()
+
+        end = downloader.Fetch(components, outfd, offset=offset, size=size,
+                               checkpoint=checkpoint)
+        checkpoint.Update(outfd, end, force=True)
+
+    if not _Matches(output_file, size, sha256):
+        checkpoint.Remove()
+        raise IOError("Downloaded file %s does not match the expected "
+                      "size or hash" % output_file)
+
+    checkpoint.complete = True
+    checkpoint.size = end
+    checkpoint.sha256 = sha256
+    checkpoint.Save()
+
+    return end, False
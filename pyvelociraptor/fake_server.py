@@ -0,0 +1,276 @@
+#!/usr/bin/python
+
+"""An in-process stand in for the Velociraptor API server.
+
+This implements the Query, VFSGetBuffer and PushEvents endpoints with
+synthetic data so the client code can be exercised and benchmarked
+without a live server. The server uses TLS with freshly generated
+certificates, so clients connect exactly as they would to the real
+server:
+
+```
+from pyvelociraptor import fake_server, velo_pandas
+
+with fake_server.FakeServer(rows=100000, batch_size=1000) as server:
+    result = velo_pandas.DataFrameQuery("SELECT * FROM info()",
+                                        config=server.config)
+```
+
+Query ignores the VQL and returns `rows` rows of nested data, each
+padded to about `row_size` bytes. Every file served by VFSGetBuffer
+has `file_size` bytes of a repeating byte pattern (see ExpectedData).
+`latency` adds a delay (in seconds) to every call and to every Query
+batch. To exercise retries and hedging, a fraction `error_rate` of
+VFSGetBuffer calls fail with UNAVAILABLE and a fraction
+`straggler_rate` take an extra `straggler_latency` seconds.
+
+Running this module starts a server and writes its API config file:
+
+$ python -m pyvelociraptor.fake_server --api_config /tmp/fake.yaml
+"""
+import argparse
+import concurrent.futures
+import datetime
+import json
+import random
+import time
+
+import grpc
+import yaml
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.x509.oid import NameOID
+from google.protobuf import empty_pb2
+
+from pyvelociraptor import api_pb2
+from pyvelociraptor import api_pb2_grpc
+
+
+_PATTERN = bytes(range(256))
+
+
+def ExpectedData(offset, length):
+    """Returns the content of every fake file at offset."""
+    start = offset % len(_PATTERN)
+    repeat = (start + length) // len(_PATTERN) + 1
+    return (_PATTERN * repeat)[start:start + length]
+
+
+class FakeAPIServicer(api_pb2_grpc.APIServicer):
+    """Serves synthetic data for the API endpoints."""
+
+    def __init__(self, rows=1000, batch_size=100, row_size=200,
+                 file_size=10 * 1024 * 1024, latency=0, error_rate=0,
+                 straggler_rate=0, straggler_latency=1):
+        self.rows = rows
+        self.batch_size = batch_size
+        self.row_size = row_size
+        self.file_size = file_size
+        self.latency = latency
+        self.error_rate = error_rate
+        self.straggler_rate = straggler_rate
+        self.straggler_latency = straggler_latency
+
+        self.events_received = 0
+        self.query_count = 0
+        self.buffer_count = 0
+
+    def _Sleep(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _Row(self, idx):
+        row = dict(
+            ClientId="C.%016x" % (idx % 5000),
+            Fqdn="host-%d.example.com" % (idx % 5000),
+            Pid=idx,
+            Name="svchost.exe",
+            CreateTime="2024-01-01T00:00:%02dZ" % (idx % 60),
+            Details=dict(Username="NT AUTHORITY\\SYSTEM", Ppid=4),
+        )
+
+        padding = self.row_size - len(json.dumps(row))
+        row["Data"] = "x" * max(0, padding)
+        return row
+
+    def Query(self, request, context):
+        self.query_count += 1
+        self._Sleep()
+
+        batch_size = request.max_row or self.batch_size
+        for query in request.Query:
+            total = 0
+            for start in range(0, self.rows, batch_size):
+                if not context.is_active():
+                    return
+
+                rows = [self._Row(i) for i in range(
+                    start, min(start + batch_size, self.rows))]
+                total += len(rows)
+
+                yield api_pb2.VQLResponse(
+                    Response=json.dumps(rows),
+                    Columns=list(rows[0]),
+                    types=[api_pb2.VQLTypeMap(column="Pid", type="int"),
+                           api_pb2.VQLTypeMap(column="CreateTime", type="timestamp")],
+                    Query=query,
+                    total_rows=total,
+                    timestamp=int(time.time() * 1000000))
+
+                self._Sleep()
+
+    def VFSGetBuffer(self, request, context):
+        self.buffer_count += 1
+        self._Sleep()
+
+        if self.error_rate and random.random() < self.error_rate:
+            context.abort(grpc.StatusCode.UNAVAILABLE, "Injected failure")
+
+        if self.straggler_rate and random.random() < self.straggler_rate:
+            time.sleep(self.straggler_latency)
+
+        length = max(0, min(request.length, self.file_size - request.offset))
+        return api_pb2.VFSFileBuffer(
+            components=request.components,
+            offset=request.offset,
+            data=ExpectedData(request.offset, length))
+
+    def PushEvents(self, request, context):
+        self._Sleep()
+        self.events_received += request.rows
+        return empty_pb2.Empty()
+
+
+def _Certificate(name, key, issuer, issuer_key, ca=False):
+    now = datetime.datetime.now(datetime.timezone.utc)
+    builder = (x509.CertificateBuilder()
+               .subject_name(x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, name)]))
+               .issuer_name(x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, issuer)]))
+               .public_key(key.public_key())
+               .serial_number(x509.random_serial_number())
+               .not_valid_before(now - datetime.timedelta(days=1))
+               .not_valid_after(now + datetime.timedelta(days=7))
+               .add_extension(x509.BasicConstraints(ca=ca, path_length=None),
+                              critical=True))
+    if not ca:
+        builder = builder.add_extension(
+            x509.SubjectAlternativeName([x509.DNSName(name)]), critical=False)
+
+    return builder.sign(issuer_key, hashes.SHA256())
+
+
+def _KeyPEM(key):
+    return key.private_bytes(
+        encoding=serialization.Encoding.PEM,
+        format=serialization.PrivateFormat.TraditionalOpenSSL,
+        encryption_algorithm=serialization.NoEncryption())
+
+
+def _CertPEM(cert):
+    return cert.public_bytes(serialization.Encoding.PEM)
+
+
+class FakeServer:
+    """Runs a FakeAPIServicer on a local TLS port.
+
+    Keyword args are passed to FakeAPIServicer. The config attribute
+    is an API config for connecting to this server.
+    """
+
+    def __init__(self, port=0, workers=32, **kw):
+        self.servicer = FakeAPIServicer(**kw)
+        self.port = port
+        self.workers = workers
+        self.config = None
+        self._server = None
+
+    def Start(self):
+        # Velociraptor uses a self signed CA and the server certificate
+        # is always issued to VelociraptorServer.
+        ca_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        ca = _Certificate("Velociraptor CA", ca_key, "Velociraptor CA", ca_key, ca=True)
+
+        server_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        server_cert = _Certificate("VelociraptorServer", server_key,
+                                   "Velociraptor CA", ca_key)
+
+        client_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        client_cert = _Certificate("api_client", client_key,
+                                   "Velociraptor CA", ca_key)
+
+        self._server = grpc.server(
+            concurrent.futures.ThreadPoolExecutor(self.workers))
+        api_pb2_grpc.add_APIServicer_to_server(self.servicer, self._server)
+
+        credentials = grpc.ssl_server_credentials(
+            [(_KeyPEM(server_key), _CertPEM(server_cert))],
+            root_certificates=_CertPEM(ca),
+            require_client_auth=True)
+        self.port = self._server.add_secure_port(
+            "127.0.0.1:%d" % self.port, credentials)
+        self._server.start()
+
+        self.config = dict(
+            api_connection_string="127.0.0.1:%d" % self.port,
+            ca_certificate=_CertPEM(ca).decode("utf8"),
+            client_cert=_CertPEM(client_cert).decode("utf8"),
+            client_private_key=_KeyPEM(client_key).decode("utf8"),
+        )
+
+        return self
+
+    def Stop(self):
+        if self._server is not None:
+            self._server.stop(0)
+            self._server = None
+
+    def __enter__(self):
+        return self.Start()
+
+    def __exit__(self, *args):
+        self.Stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run a fake Velociraptor API server.")
+    parser.add_argument("--api_config", type=str, required=True,
+                        help="Write the API config for this server to this file.")
+    parser.add_argument("--port", type=int, default=0)
+    parser.add_argument("--rows", type=int, default=1000)
+    parser.add_argument("--batch_size", type=int, default=100)
+    parser.add_argument("--row_size", type=int, default=200)
+    parser.add_argument("--file_size", type=int, default=10 * 1024 * 1024)
+    parser.add_argument("--latency", type=float, default=0,
+                        help="Delay in seconds added to every call.")
+    parser.add_argument("--error_rate", type=float, default=0,
+                        help="Fraction of VFSGetBuffer calls which fail.")
+    parser.add_argument("--straggler_rate", type=float, default=0,
+                        help="Fraction of VFSGetBuffer calls which are slow.")
+    parser.add_argument("--straggler_latency", type=float, default=1,
+                        help="Extra delay in seconds of slow calls.")
+    args = parser.parse_args()
+
+    server = FakeServer(port=args.port, rows=args.rows,
+                        batch_size=args.batch_size, row_size=args.row_size,
+                        file_size=args.file_size, latency=args.latency,
+                        error_rate=args.error_rate,
+                        straggler_rate=args.straggler_rate,
+                        straggler_latency=args.straggler_latency)
+    with server:
+        with open(args.api_config, "w") as fd:
+            fd.write(yaml.safe_dump(server.config))
+
+        print("Serving on %s - API config in %s" % (
+            server.config["api_connection_string"], args.api_config))
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == '__main__':
+    main()
@@ -7,59 +7,40 @@ and fetch a file from the filestore.
 
 """
 import argparse
-import json
-import grpc
-import time
-import yaml
 import sys
 
 import pyvelociraptor
-from pyvelociraptor import api_pb2
-from pyvelociraptor import api_pb2_grpc
-
-
-def run(config, vfs_path, org_id):
-    # Fill in the SSL params from the api_client config file. You can
-    # get such a file:
-    # velociraptor --config server.config.yaml config api_client > api_client.conf.yaml
-    creds = grpc.ssl_channel_credentials(
-        root_certificates=config["ca_certificate"].encode("utf8"),
-        private_key=config["client_private_key"].encode("utf8"),
-        certificate_chain=config["client_cert"].encode("utf8"))
-
-    # This option is required to connect to the grpc server by IP - we
-    # use self signed certs.
-    options = (('grpc.ssl_target_name_override', "VelociraptorServer",),)
-
-    # The first step is to open a gRPC channel to the server..
-    with grpc.secure_channel(config["api_connection_string"],
-                             creds, options) as channel:
-        stub = api_pb2_grpc.APIStub(channel)
-
-        # The request consists of one or more VQL queries. Note that
-        # you can collect artifacts by simply naming them using the
-        # "Artifact" plugin.
-        offset = 0
-        while 1:
-            request = api_pb2.VFSFileBuffer(
-                org_id=org_id,
-
-                # Paths must be given as separate components (they may
-                # contain / themselves).
-                components=vfs_path.split("/"),
-
-                # For demonstration we set a small buffer but you
-                # should use a larger one in practice.
-                length=1024,
-                offset=offset,
-            )
-
-            res = stub.VFSGetBuffer(request)
-            if len(res.data) == 0:
-                break
-
-            sys.stdout.buffer.write(res.data)
-            offset+=len(res.data)
+from pyvelociraptor import client
+from pyvelociraptor import download
+from pyvelociraptor import telemetry
+
+
+def run(config, vfs_path, org_id, chunk_size=download.DEFAULT_CHUNK_SIZE,
+        concurrency=download.DEFAULT_CONCURRENCY, output=None,
+        profile=None, retries=download.DEFAULT_RETRIES,
+        deadline=download.DEFAULT_DEADLINE, hedge_after=None):
+    # The client keeps a warm channel to the server which is
+    # reused between calls.
+    stub = client.GetClient(config, profile=profile,
+                            default_profile="bulk-download").stub()
+
+    # Failed chunk reads are retried and slow ones may be hedged.
+    downloader = download.Downloader(
+        stub, org_id=org_id, chunk_size=chunk_size, concurrency=concurrency,
+        retries=retries, deadline=deadline, hedge_after=hedge_after)
+
+    # Paths must be given as separate components (they may contain /
+    # themselves).
+    components = vfs_path.split("/")
+
+    # Writing to a file lets us resume an interrupted download.
+    if output:
+        download.FetchResumable(downloader, components, output)
+        return
+
+    # Several chunks are read at once - stdout is not seekable so
+    # they are written out in order as they arrive.
+    downloader.Fetch(components, sys.stdout.buffer, positional=False)
 
 def main():
     parser = argparse.ArgumentParser(
@@ -73,12 +54,47 @@ def main():
     parser.add_argument("--org", type=str,
                         help="Org ID to use")
 
+    parser.add_argument("--chunk_size", type=int,
+                        default=download.DEFAULT_CHUNK_SIZE,
+                        help="Size of each VFSGetBuffer read")
+
+    parser.add_argument("--concurrency", type=int,
+                        default=download.DEFAULT_CONCURRENCY,
+                        help="Number of reads to keep in flight")
+
+    parser.add_argument("--retries", type=int, default=download.DEFAULT_RETRIES,
+                        help="Times a failed chunk read is retried")
+
+    parser.add_argument("--chunk_deadline", type=float,
+                        default=download.DEFAULT_DEADLINE,
+                        help="Seconds allowed for each chunk read")
+
+    parser.add_argument("--hedge_after", type=float,
+                        help="Send a read again if it takes longer than this "
+                        "many seconds")
+
+    parser.add_argument("--output", type=str,
+                        help="Write to this file instead of stdout. "
+                        "Interrupted downloads are resumed.")
+
+    parser.add_argument("--stats", action="store_true",
+                        help="Print API call statistics to stderr when done.")
+
+    parser.add_argument("--profile", type=str, choices=list(client.PROFILES),
+                        help="The transport profile (default from the API "
+                        "config, or bulk-download).")
+
     parser.add_argument('vfs_path', type=str, help='The path to get.')
 
     args = parser.parse_args()
 
     config = pyvelociraptor.LoadConfigFile(args.config)
-    run(config, args.vfs_path, args.org)
+    with telemetry.PrintSummary(args.stats):
+        run(config, args.vfs_path, args.org,
+            chunk_size=args.chunk_size, concurrency=args.concurrency,
+            output=args.output, profile=args.profile,
+            retries=args.retries, deadline=args.chunk_deadline,
+            hedge_after=args.hedge_after)
 
 if __name__ == '__main__':
     main()
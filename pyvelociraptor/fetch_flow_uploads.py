@@ -8,60 +8,205 @@ server and fetch all uploaded files from a single flow.
 We first make a query to the server to find all the uploads in a flow,
 then for each upload we fetch the data and store it in a directory.
 
+Files are fetched by a bounded pool of workers as soon as their rows
+arrive from the query, so the query stream and the downloads run at
+the same time.
+
 """
 import argparse
-import json
-import grpc
+import concurrent.futures
+import hashlib
+import threading
 import time
-import yaml
-import sys
 import os.path
 
 import pyvelociraptor
-from pyvelociraptor import api_pb2
-from pyvelociraptor import api_pb2_grpc
+from pyvelociraptor import client
+from pyvelociraptor import decoder
+from pyvelociraptor import download
+from pyvelociraptor import lazy
+from pyvelociraptor import telemetry
+
+api_pb2 = lazy.Import("pyvelociraptor.api_pb2")
 
 
-def fetch_file(stub, components, outfd, org_id):
+def fetch_file(stub, components, outfd, org_id,
+               chunk_size=download.DEFAULT_CHUNK_SIZE,
+               concurrency=download.DEFAULT_CONCURRENCY, **kw):
     """ Use the stub to fetch data from the server.
 
-    Write the data to the out fd.
+    Write the data to the out fd. Several chunks are fetched at once
+    and written at their offsets as they arrive. Other keyword args
+    (retries, deadline, hedge_after) are passed to the Downloader.
+    """
+    downloader = download.Downloader(
+        stub, org_id=org_id, chunk_size=chunk_size, concurrency=concurrency,
+        **kw)
+
+    return downloader.Fetch(components, outfd)
+
+
+class FileStatus:
+    """The status of a single file download."""
+
+    def __init__(self, components, output_file, expected_size=None,
+                 sha256=None):
+        self.components = components
+        self.output_file = output_file
+        self.expected_size = expected_size
+        self.sha256 = sha256
+        self.size = 0
+
+        # Bytes fetched in this run - less than size when resumed.
+        self.fetched = 0
+        self.elapsed = 0
+        self.skipped = False
+        self.error = None
+
+    def __str__(self):
+        if self.error:
+            return "Failed %s: %s" % (self.output_file, self.error)
+
+        if self.skipped:
+            return "Skipped %s (already complete)" % self.output_file
+
+        return "Fetched %s (%d bytes in %.2fs)" % (
+            self.output_file, self.size, self.elapsed)
+
+
+class UploadFetcher:
+    """Fetches files with a bounded pool of workers.
+
+    Submit() blocks when all the workers are busy and the queue is
+    full, which applies back pressure on the query stream.
     """
-    offset = 0
-    while 1:
-        request = api_pb2.VFSFileBuffer(
-            org_id=org_id,
-            components=components,
-
-            # This should be between 1 mb to 4mb for optimum
-            # performance.
-            length=1024 * 1024,
-            offset=offset,
-        )
-
-        res = stub.VFSGetBuffer(request)
-        if len(res.data) == 0:
-            break
-
-        outfd.write(res.data)
-        offset+=len(res.data)
-
-
-def run(config, client_id, flow_id, output_path, export_zip, org_id):
-    # Fill in the SSL params from the api_client config file. You can
-    # get such a file:
-    # velociraptor --config server.config.yaml config api_client > api_client.conf.yaml
-    creds = grpc.ssl_channel_credentials(
-        root_certificates=config["ca_certificate"].encode("utf8"),
-        private_key=config["client_private_key"].encode("utf8"),
-        certificate_chain=config["client_cert"].encode("utf8"))
-
-    # This option is required to connect to the grpc server by IP - we
-    # use self signed certs.
-    options = (('grpc.ssl_target_name_override', "VelociraptorServer",),)
 
+    def __init__(self, stub, output_path, org_id, workers=4,
+                 chunk_size=download.DEFAULT_CHUNK_SIZE,
+                 concurrency=download.DEFAULT_CONCURRENCY,
+                 resume=True, verbose=True,
+                 retries=download.DEFAULT_RETRIES,
+                 deadline=download.DEFAULT_DEADLINE, hedge_after=None):
+        self.stub = stub
+        self.output_path = output_path
+        self.org_id = org_id
+        self.workers = max(1, workers)
+        self.chunk_size = chunk_size
+        self.concurrency = concurrency
+        self.resume = resume
+        self.verbose = verbose
+
+        # Passed to each Downloader.
+        self.read_options = dict(retries=retries, deadline=deadline,
+                                 hedge_after=hedge_after)
+
+        self.results = []
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.workers * 2)
+        self._pool = concurrent.futures.ThreadPoolExecutor(self.workers)
+        self._futures = []
+        self._names = set()
+        self._start = time.time()
+
+    def _OutputFile(self, components):
+        # Uploads from different directories often share a basename
+        # and two workers must never write the same file. Later ones
+        # get a suffix derived from the full path, which stays the
+        # same when the flow is fetched again.
+        name = components[-1]
+        if name in self._names:
+            base, ext = os.path.splitext(name)
+            digest = hashlib.sha1(
+                "/".join(components).encode("utf8")).hexdigest()[:8]
+            name = "%s-%s%s" % (base, digest, ext)
+
+            # The same upload may be listed more than once.
+            count = 1
+            while name in self._names:
+                count += 1
+                name = "%s-%s-%d%s" % (base, digest, count, ext)
+
+        self._names.add(name)
+        return os.path.join(self.output_path, name)
+
+    def Submit(self, components, size=None, sha256=None):
+        output_file = self._OutputFile(components)
+        status = FileStatus(components, output_file,
+                            expected_size=size, sha256=sha256)
+
+        self._slots.acquire()
+        try:
+            self._futures.append(self._pool.submit(self._Fetch, status))
+        except BaseException:
+            self._slots.release()
+            raise
+
+        return status
+
+    def _Fetch(self, status):
+        try:
+            start = time.time()
+            if self.resume:
+                downloader = download.Downloader(
+                    self.stub, org_id=self.org_id,
+                    chunk_size=self.chunk_size, concurrency=self.concurrency,
+                    **self.read_options)
+
+                status.size, status.skipped = download.FetchResumable(
+                    downloader, status.components, status.output_file,
+                    size=status.expected_size, sha256=status.sha256)
+                status.fetched = downloader.bytes_read
+
+            else:
+                with open(status.output_file, "wb") as outfd:
+                    status.size = fetch_file(
+                        self.stub, status.components, outfd, self.org_id,
+                        chunk_size=self.chunk_size, concurrency=self.concurrency,
+                        **self.read_options)
+                status.fetched = status.size
+            status.elapsed = time.time() - start
+
+        except Exception as e:
+            status.error = e
+
+        finally:
+            self._slots.release()
+
+        with self._lock:
+            self.results.append(status)
+            if self.verbose:
+                print(status)
+
+        return status
+
+    def Wait(self):
+        """Waits for all the files to complete and returns their status."""
+        concurrent.futures.wait(self._futures)
+        self._pool.shutdown()
+        return self.results
+
+    def Stats(self):
+        """Returns the number of files, bytes fetched and bytes/sec.
+
+        Resumed and skipped files only count the bytes fetched in this
+        run.
+        """
+        with self._lock:
+            total = sum(x.fetched for x in self.results)
+            count = len(self.results)
+
+        elapsed = time.time() - self._start
+        return count, total, total / elapsed if elapsed > 0 else 0
+
+
+def run(config, client_id, flow_id, output_path, export_zip, org_id,
+        chunk_size=download.DEFAULT_CHUNK_SIZE,
+        concurrency=download.DEFAULT_CONCURRENCY, workers=4, resume=True,
+        profile=None, retries=download.DEFAULT_RETRIES,
+        deadline=download.DEFAULT_DEADLINE, hedge_after=None):
     query = '''
-    SELECT Upload.Components AS Components
+    SELECT Upload.Components AS Components,
+           uploaded_size AS Size, Upload.sha256 AS Sha256
     FROM uploads(flow_id=FlowId, client_id=ClientId)
     '''
 
@@ -72,41 +217,55 @@ def run(config, client_id, flow_id, output_path, export_zip, org_id):
         FROM scope()
         '''
 
-    # The first step is to open a gRPC channel to the server..
-    with grpc.secure_channel(config["api_connection_string"],
-                             creds, options) as channel:
-        stub = api_pb2_grpc.APIStub(channel)
-
-        # The request consists of one or more VQL queries. Note that
-        # you can collect artifacts by simply naming them using the
-        # "Artifact" plugin.
-        request = api_pb2.VQLCollectorArgs(
-            org_id=org_id,
-            max_wait=1,
-            max_row=100,
-            Query=[api_pb2.VQLRequest(
-                Name="Test",
-                VQL=query,
-            )],
-            env=[api_pb2.VQLEnv(key="FlowId", value=flow_id),
-                 api_pb2.VQLEnv(key="ClientId", value=client_id),
-                 ],
-        )
-
-        # This will block as responses are streamed from the
-        # server. If the query is an event query we will run this loop
-        # forever.
+    # The client keeps a warm channel to the server which is
+    # reused between calls.
+    stub = client.GetClient(config, profile=profile,
+                            default_profile="bulk-download").stub()
+
+    # The request consists of one or more VQL queries. Note that
+    # you can collect artifacts by simply naming them using the
+    # "Artifact" plugin.
+    request = api_pb2.VQLCollectorArgs(
+        org_id=org_id,
+        max_wait=1,
+        max_row=100,
+        Query=[api_pb2.VQLRequest(
+            Name="Test",
+            VQL=query,
+        )],
+        env=[api_pb2.VQLEnv(key="FlowId", value=flow_id),
+             api_pb2.VQLEnv(key="ClientId", value=client_id),
+             ],
+    )
+
+    # With resume enabled an interrupted run continues from the last
+    # checkpoint and files which are already complete are skipped.
+    fetcher = UploadFetcher(stub, output_path, org_id, workers=workers,
+                            chunk_size=chunk_size, concurrency=concurrency,
+                            resume=resume, retries=retries,
+                            deadline=deadline, hedge_after=hedge_after)
+
+    # This will block as responses are streamed from the server. Each
+    # file is handed to the fetcher as soon as it is seen so
+    # downloads start while the query is still running.
+    try:
         for response in stub.Query(request):
             if response.Response:
-                package = json.loads(response.Response)
+                package = decoder.DecodeRows(response)
 
                 for row in package:
                     components = row.get("Components", [])
-                    output_file = os.path.join(output_path, components[-1])
-                    print ("Fetching file %s to %s" % (components, output_file))
+                    fetcher.Submit(components, size=row.get("Size"),
+                                   sha256=row.get("Sha256"))
+    finally:
+        results = fetcher.Wait()
 
-                    with open(output_file, "wb") as outfd:
-                        fetch_file(stub, components, outfd, org_id)
+    count, total, rate = fetcher.Stats()
+    failed = [x for x in results if x.error]
+    print("Fetched %d files (%d bytes) at %.2f MB/s, %d failed" % (
+        count - len(failed), total, rate / 1024 / 1024, len(failed)))
+
+    return results
 
 
 def main():
@@ -124,11 +283,42 @@ def main():
     parser.add_argument('--zip', action=argparse.BooleanOptionalAction,
                         help='If set we upload a zip file.')
     parser.add_argument('--output', type=str, default="/tmp/", help='The output directory to write.')
+    parser.add_argument("--chunk_size", type=int,
+                        default=download.DEFAULT_CHUNK_SIZE,
+                        help="Size of each VFSGetBuffer read")
+    parser.add_argument("--concurrency", type=int,
+                        default=download.DEFAULT_CONCURRENCY,
+                        help="Number of reads to keep in flight per file")
+    parser.add_argument("--retries", type=int, default=download.DEFAULT_RETRIES,
+                        help="Times a failed chunk read is retried")
+    parser.add_argument("--chunk_deadline", type=float,
+                        default=download.DEFAULT_DEADLINE,
+                        help="Seconds allowed for each chunk read")
+    parser.add_argument("--hedge_after", type=float,
+                        help="Send a read again if it takes longer than this "
+                        "many seconds")
+    parser.add_argument("--workers", type=int, default=4,
+                        help="Number of files to fetch at the same time")
+    parser.add_argument('--resume', action=argparse.BooleanOptionalAction,
+                        default=True,
+                        help='Continue interrupted downloads and skip complete files.')
+    parser.add_argument("--profile", type=str, choices=list(client.PROFILES),
+                        help="The transport profile (default from the API "
+                        "config, or bulk-download).")
+
+    parser.add_argument("--stats", action="store_true",
+                        help="Print API call statistics to stderr when done.")
 
     args = parser.parse_args()
 
     config = pyvelociraptor.LoadConfigFile(args.config)
-    run(config, args.client_id, args.flow_id, args.output, args.zip, args.org)
+    with telemetry.PrintSummary(args.stats):
+        run(config, args.client_id, args.flow_id, args.output, args.zip,
+            args.org, chunk_size=args.chunk_size,
+            concurrency=args.concurrency, workers=args.workers,
+            resume=args.resume, profile=args.profile,
+            retries=args.retries, deadline=args.chunk_deadline,
+            hedge_after=args.hedge_after)
 
 if __name__ == '__main__':
     main()
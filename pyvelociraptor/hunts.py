@@ -0,0 +1,151 @@
+"""Parallel retrieval of large hunt results.
+
+Reading hunt_results() of a big hunt is a single stream from the
+server consumed by a single thread. HuntResults() instead splits the
+hunt's flows into shards, reads each shard with its own Query call
+and decodes the shards in parallel:
+
+```
+from pyvelociraptor import hunts
+
+# A dict of columns, as returned by velo_pandas.DataFrameQuery()
+result = hunts.HuntResults("H.380432d0", "Windows.System.Pslist",
+                           shards=16)
+
+# Or write each shard to its own file in a directory.
+files = hunts.HuntResults("H.380432d0", "Windows.System.Pslist",
+                          shards=16, output="/data/pslist",
+                          format="parquet")
+```
+
+Shards are made either by spreading the flows evenly (shard_by="flows")
+or by splitting the sorted client ids into contiguous ranges
+(shard_by="client_range"), so each output file covers a range of
+clients. The flows may also be given explicitly instead of a hunt id.
+
+JSON decoding holds the GIL, so to use more than one core set
+use_processes=True. Each worker process then opens its own channel. In
+threads, the shards share `channels` gRPC channels.
+"""
+import concurrent.futures
+import json
+import multiprocessing
+import os
+
+from pyvelociraptor import client
+from pyvelociraptor import sinks
+from pyvelociraptor import velo_pandas
+
+
+HUNT_FLOWS_QUERY = """
+    SELECT ClientId, FlowId, client_info(client_id=ClientId).os_info.fqdn AS Fqdn
+    FROM hunt_flows(hunt_id=HuntId)"""
+
+# Columns are named as hunt_results() names them.
+SHARD_QUERY = """
+    SELECT * FROM foreach(row=parse_json_array(data=Flows), query={
+      SELECT *, ClientId, FlowId, Fqdn
+      FROM source(client_id=ClientId, flow_id=FlowId,
+                  artifact=Artifact, source=Source)
+    })"""
+
+
+def HuntFlows(hunt_id, config=None, org_id=None):
+    """Returns the flows of a hunt as dicts of ClientId, FlowId and Fqdn."""
+    result = velo_pandas.DataFrameQuery(HUNT_FLOWS_QUERY, org_id=org_id,
+                                        config=config, cache=False,
+                                        HuntId=hunt_id)
+    return [dict(zip(result, values)) for values in zip(*result.values())]
+
+
+def Shard(flows, shards, shard_by="flows"):
+    """Splits a list of flows into at most `shards` lists."""
+    shards = max(1, min(shards, len(flows)))
+
+    if shard_by == "flows":
+        return [flows[idx::shards] for idx in range(shards)]
+
+    if shard_by == "client_range":
+        ordered = sorted(flows, key=lambda flow: flow["ClientId"])
+        size = -(-len(ordered) // shards)
+        return [ordered[idx:idx + size] for idx in range(0, len(ordered), size)]
+
+    raise ValueError("Unknown shard_by %s: must be flows or client_range" %
+                     shard_by)
+
+
+def _FetchShard(config, org_id, artifact, source, flows, max_row,
+                path=None, format=None):
+    # Runs in a worker thread or process.
+    request = velo_pandas.QueryRequest(
+        SHARD_QUERY, org_id=org_id, max_row=max_row,
+        Flows=json.dumps(flows), Artifact=artifact, Source=source or "")
+
+    responses = client.GetClient(config).stub().Query(request)
+    if path is None:
+        return velo_pandas.ResponseColumns(responses)
+
+    with sinks.Open(path, format=format) as sink:
+        for response in responses:
+            sink.WriteResponse(response)
+
+    return sink.files
+
+
+def HuntResults(hunt_id, artifact, source=None, flows=None, shards=8,
+                shard_by="flows", workers=None, channels=4,
+                use_processes=False, output=None, format="parquet",
+                max_row=0, org_id=None, config=None):
+    """Reads the results of a hunt with concurrent Query calls.
+
+    flows is a list of dicts with ClientId and FlowId (and optionally
+    Fqdn) keys. If it is None the flows of hunt_id are used.
+
+    Returns a dict of columns, or if output is a directory, writes one
+    file per shard into it (in the given sinks format) and returns the
+    list of files written.
+    """
+    # Worker processes need a config they can connect with.
+    config = client.GetClient(config).config
+
+    if flows is None:
+        flows = HuntFlows(hunt_id, config=config, org_id=org_id)
+
+    flows = [{"Fqdn": None, **flow} for flow in flows]
+    if not flows:
+        return [] if output else {}
+
+    parts = Shard(flows, shards, shard_by=shard_by)
+    workers = workers or len(parts)
+
+    paths = [None] * len(parts)
+    if output:
+        os.makedirs(output, exist_ok=True)
+        paths = [os.path.join(output, "shard-%05d.%s" % (idx, format))
+                 for idx in range(len(parts))]
+
+    if use_processes:
+        # gRPC does not survive a fork, so the workers are spawned.
+        executor = concurrent.futures.ProcessPoolExecutor(
+            workers, mp_context=multiprocessing.get_context("spawn"))
+        target = config
+    else:
+        # Many concurrent streams on one channel share a single
+        # connection, so spread them over a few channels.
+        executor = concurrent.futures.ThreadPoolExecutor(workers)
+        target = client.Client(config, pool_size=channels)
+
+    try:
+        with executor as pool:
+            futures = [pool.submit(_FetchShard, target, org_id, artifact,
+                                   source, part, max_row, path, format)
+                       for part, path in zip(parts, paths)]
+            results = [future.result() for future in futures]
+    finally:
+        if not use_processes:
+            target.close()
+
+    if output:
+        return [filename for files in results for filename in files]
+
+    return velo_pandas.MergeColumns(results)
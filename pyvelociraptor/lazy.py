@@ -0,0 +1,29 @@
+"""Deferred imports.
+
+The console scripts are often run many times from other programs and
+most of their start up time is spent importing grpc, protobuf and
+cryptography. Modules imported with Import() are only loaded on first
+attribute access, so `--help` (or an argument error) does not pay for
+them.
+"""
+import importlib.util
+import sys
+
+
+def Import(name):
+    """Returns the module, deferring its execution until first use."""
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ImportError("No module named %r" % name, name=name)
+
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+
+    return module
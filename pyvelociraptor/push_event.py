@@ -53,44 +53,35 @@ The result will be something like
 import argparse
 import collections
 import json
-import grpc
-import yaml
 
-from pyvelociraptor import api_pb2
-from pyvelociraptor import api_pb2_grpc
+from pyvelociraptor import client
+from pyvelociraptor import lazy
+from pyvelociraptor import telemetry
 
-def run(config, queue, org_id, client_id, event):
+api_pb2 = lazy.Import("pyvelociraptor.api_pb2")
+yaml = lazy.Import("yaml")
+
+def run(config, queue, org_id, client_id, event, verbose=True, profile=None):
     serialized = ""
     count = 0
     for line in event:
         serialized += json.dumps(line) + "\n"
         count += 1
 
-    # Fill in the SSL params from the api_client config file. You can get such a file:
-    # velociraptor --config server.config.yaml config api_client > api_client.conf.yaml
-    creds = grpc.ssl_channel_credentials(
-        root_certificates=config["ca_certificate"].encode("utf8"),
-        private_key=config["client_private_key"].encode("utf8"),
-        certificate_chain=config["client_cert"].encode("utf8"))
-
-    # This option is required to connect to the grpc server by IP - we
-    # use self signed certs.
-    options = (('grpc.ssl_target_name_override', "VelociraptorServer",),)
-
-    # The first step is to open a gRPC channel to the server..
-    with grpc.secure_channel(config["api_connection_string"],
-                             creds, options) as channel:
-        stub = api_pb2_grpc.APIStub(channel)
-
-        request = api_pb2.PushEventRequest(
-            artifact=queue,
-            client_id=client_id,
-            jsonl=serialized.encode("utf8"),
-            rows=count,
-            org_id=org_id,
-        )
-
-        err = stub.PushEvents(request)
+    # The client keeps a warm channel to the server which is
+    # reused between calls.
+    stub = client.GetClient(config, profile=profile).stub()
+
+    request = api_pb2.PushEventRequest(
+        artifact=queue,
+        client_id=client_id,
+        jsonl=serialized.encode("utf8"),
+        rows=count,
+        org_id=org_id,
+    )
+
+    err = stub.PushEvents(request)
+    if verbose:
         print(err)
 
 def main():
@@ -111,6 +102,11 @@ def main():
 
     parser.add_argument("--org", type=str,
                         help="Org ID to use")
+    parser.add_argument("--profile", type=str, choices=list(client.PROFILES),
+                        help="The transport profile (default from the API config).")
+
+    parser.add_argument("--stats", action="store_true",
+                        help="Print API call statistics to stderr when done.")
 
     args = parser.parse_args()
 
@@ -123,7 +119,9 @@ def main():
         event_data = [event_data,]
 
     config = yaml.safe_load(open(args.config).read())
-    run(config, args.queue, args.org, args.client_id, event_data)
+    with telemetry.PrintSummary(args.stats):
+        run(config, args.queue, args.org, args.client_id, event_data,
+            profile=args.profile)
 
 if __name__ == '__main__':
     main()
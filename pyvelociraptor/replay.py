@@ -0,0 +1,249 @@
+"""Record and replay Query response streams.
+
+Developing post processing code against an expensive query means
+running the same VQL on the server over and over. Instead, record the
+raw VQLResponse stream once and replay it from disk:
+
+```
+from pyvelociraptor import replay, velo_pandas
+
+# Runs the query on the server and records the responses.
+recorder = replay.RecordingClient("/tmp/hunt.vqlr", config)
+velo_pandas.DataFrameQuery(query, config=recorder, HuntId=HuntId)
+
+# Later - no server needed.
+player = replay.ReplayClient("/tmp/hunt.vqlr")
+result = velo_pandas.DataFrameQuery(query, config=player)
+```
+
+The recording is a sequence of length delimited records (each preceded
+by its size as a varint). A record holds the key of the request, the
+id of the response stream and one serialized VQLResponse. The key is a
+hash of the serialized VQLCollectorArgs, so a ReplayClient answers
+each Query with the stream recorded for the same request. If the same
+request was recorded several times, successive calls replay the
+recorded streams in order.
+
+ReplayClient and RecordingClient can be used anywhere a config or
+client.Client is accepted.
+"""
+import hashlib
+import os
+import threading
+
+from pyvelociraptor import client
+from pyvelociraptor import lazy
+
+api_pb2 = lazy.Import("pyvelociraptor.api_pb2")
+
+
+def _EncodeVarint(value):
+    result = bytearray()
+    while True:
+        bits = value & 0x7f
+        value >>= 7
+        if value:
+            result.append(bits | 0x80)
+        else:
+            result.append(bits)
+            return bytes(result)
+
+
+def _ReadVarint(fd):
+    result = 0
+    shift = 0
+    while True:
+        b = fd.read(1)
+        if not b:
+            if shift:
+                raise IOError("Truncated recording")
+            return None
+
+        result |= (b[0] & 0x7f) << shift
+        if not b[0] & 0x80:
+            return result
+
+        shift += 7
+
+
+def RequestKey(request):
+    """Returns the key a Query request is recorded under."""
+    data = request.SerializeToString(deterministic=True)
+    return hashlib.sha256(data).hexdigest()[:32]
+
+
+def _WriteRecord(fd, key, stream, response):
+    header = ("%s %s" % (key, stream)).encode("utf8")
+    data = response.SerializeToString()
+
+    # A single write so concurrent recorders do not interleave.
+    fd.write(_EncodeVarint(len(header)) + header +
+             _EncodeVarint(len(data)) + data)
+
+
+def _ReadRecords(path):
+    # Yields (key, stream, offset, size) for each record, where the
+    # response data is size bytes at offset.
+    with open(path, "rb") as fd:
+        while True:
+            size = _ReadVarint(fd)
+            if size is None:
+                return
+
+            header = fd.read(size)
+            if len(header) != size:
+                raise IOError("Truncated recording %s" % path)
+
+            size = _ReadVarint(fd)
+            if size is None:
+                raise IOError("Truncated recording %s" % path)
+
+            key, stream = header.decode("utf8").split(" ", 1)
+            offset = fd.tell()
+            fd.seek(size, os.SEEK_CUR)
+            yield key, stream, offset, size
+
+
+def _ReadResponse(fd, offset, size):
+    fd.seek(offset)
+    data = fd.read(size)
+    if len(data) != size:
+        raise IOError("Truncated recording")
+
+    return api_pb2.VQLResponse.FromString(data)
+
+
+def Replay(path, key=None):
+    """Yields the VQLResponse messages recorded in path.
+
+    If key (see RequestKey) is given only the responses to that
+    request are returned.
+    """
+    with open(path, "rb") as fd:
+        for record_key, _, offset, size in _ReadRecords(path):
+            if key is None or record_key == key:
+                yield _ReadResponse(fd, offset, size)
+
+
+class _Call:
+    """A response stream which can be cancelled like a gRPC call."""
+
+    def __init__(self, responses, cancel=None):
+        self._responses = iter(responses)
+        self._cancel = cancel
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self._responses)
+
+    def cancel(self):
+        if self._cancel is not None:
+            return self._cancel()
+
+        self._responses.close()
+        return True
+
+
+class _RecordingStub:
+    def __init__(self, stub, recorder):
+        self._stub = stub
+        self._recorder = recorder
+
+    def Query(self, request, **kw):
+        call = self._stub.Query(request, **kw)
+        return _Call(self._recorder._Record(request, call), call.cancel)
+
+    def __getattr__(self, name):
+        return getattr(self._stub, name)
+
+
+class RecordingClient(client.Client):
+    """A client which records every Query response stream to path.
+
+    Responses of several queries are appended to the same file.
+    """
+
+    def __init__(self, path, config=None, truncate=True):
+        self.client = client.GetClient(config)
+        self.config = self.client.config
+        self.path = path
+        self._lock = threading.Lock()
+        self._streams = 0
+
+        if truncate:
+            open(path, "wb").close()
+
+    def _Record(self, request, responses):
+        key = RequestKey(request)
+        with self._lock:
+            self._streams += 1
+            stream = "%d.%d" % (os.getpid(), self._streams)
+
+        with open(self.path, "ab", buffering=0) as fd:
+            for response in responses:
+                with self._lock:
+                    _WriteRecord(fd, key, stream, response)
+                yield response
+
+    def stub(self):
+        return _RecordingStub(self.client.stub(), self)
+
+    def channel(self):
+        return self.client.channel()
+
+    def close(self):
+        pass
+
+
+class _ReplayStub:
+    def __init__(self, player):
+        self._player = player
+
+    def Query(self, request, **kw):
+        return _Call(self._player._Replay(request))
+
+
+class ReplayClient(client.Client):
+    """A client which answers each Query from a recording."""
+
+    def __init__(self, path):
+        self.path = path
+        self.config = dict(api_connection_string="replay:" + path)
+        self._lock = threading.Lock()
+        self._index = None
+        self._calls = {}
+
+    def _Streams(self, key):
+        with self._lock:
+            if self._index is None:
+                # key -> {stream: [(offset, size)]} in recorded order.
+                self._index = {}
+                for record_key, stream, offset, size in _ReadRecords(self.path):
+                    self._index.setdefault(record_key, {}).setdefault(
+                        stream, []).append((offset, size))
+
+            streams = list(self._index.get(key, {}).values())
+            if not streams:
+                raise KeyError("Query was not recorded in %s" % self.path)
+
+            # Each call gets the next recording of the same request.
+            idx = self._calls.get(key, 0)
+            self._calls[key] = idx + 1
+            return streams[min(idx, len(streams) - 1)]
+
+    def _Replay(self, request):
+        records = self._Streams(RequestKey(request))
+        with open(self.path, "rb") as fd:
+            for offset, size in records:
+                yield _ReadResponse(fd, offset, size)
+
+    def stub(self):
+        return _ReplayStub(self)
+
+    def channel(self):
+        raise TypeError("A replay client has no channel")
+
+    def close(self):
+        pass
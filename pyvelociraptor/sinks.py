@@ -0,0 +1,292 @@
+"""Streaming result sinks.
+
+Sinks write query results to files one response batch at a time, so
+exports of any size run in bounded memory. Output can roll over to a
+new file after a number of rows or bytes:
+
+```
+from pyvelociraptor import sinks
+
+with sinks.Open("/data/hunt.parquet", max_rows=1000000) as sink:
+    for response in stub.Query(request):
+        sink.WriteResponse(response)
+```
+
+Rolled over files are named by adding a sequence number before the
+extension (hunt-00000.parquet, hunt-00001.parquet, ...). Formats with a
+fixed schema (CSV, Parquet and Arrow) also start a new file when the
+columns or their types change.
+
+JSONL and CSV need only the standard library. Parquet and Arrow IPC
+need pyarrow (pip install pyarrow). For CSV, Parquet and Arrow, nested
+values (dicts and lists) are stored as JSON strings.
+"""
+import csv
+import io
+import json
+import os
+
+from pyvelociraptor import decoder
+
+
+class Sink:
+    """Base class for sinks. Handles file naming and roll over."""
+
+    EXTENSION = ""
+
+    def __init__(self, path, max_rows=None, max_bytes=None):
+        self.path = path
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.files = []
+        self.total_rows = 0
+
+        self._fd = None
+        self._rows = 0
+        self._columns = None
+
+    def _Filename(self):
+        # Without roll over only a change of schema starts a new file.
+        if not self.files and not (self.max_rows or self.max_bytes):
+            return self.path
+
+        base, ext = os.path.splitext(self.path)
+        return "%s-%05d%s" % (base, len(self.files), ext or self.EXTENSION)
+
+    def _Open(self, columns):
+        filename = self._Filename()
+        self.files.append(filename)
+        self._fd = open(filename, "wb")
+        self._rows = 0
+        self._columns = list(columns)
+        self.OpenFile(self._fd, self._columns)
+
+    def _Close(self):
+        if self._fd is not None:
+            self.CloseFile(self._fd)
+            self._fd.close()
+            self._fd = None
+
+    def Write(self, rows, columns):
+        """Writes a batch of rows (a list of dicts) with these columns."""
+        if not rows:
+            return
+
+        columns = list(columns) or list(rows[0])
+        if self._fd is not None and not self.Compatible(columns):
+            self._Close()
+
+        if self._fd is None:
+            self._Open(columns)
+
+        self.WriteRows(self._fd, rows)
+        self._rows += len(rows)
+        self.total_rows += len(rows)
+
+        if ((self.max_rows and self._rows >= self.max_rows) or
+            (self.max_bytes and self._fd.tell() >= self.max_bytes)):
+            self._Close()
+
+    def WriteResponse(self, response):
+        """Writes the rows in a VQLResponse."""
+        if response.Response:
+            self.Write(decoder.DecodeResponse(response), response.Columns)
+
+    def Close(self):
+        self._Close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.Close()
+
+    # The methods below are implemented by each format.
+    def OpenFile(self, fd, columns):
+        pass
+
+    def CloseFile(self, fd):
+        pass
+
+    def Compatible(self, columns):
+        """Returns False if the current file can not take these columns."""
+        return True
+
+    def WriteRows(self, fd, rows):
+        raise NotImplementedError()
+
+
+class JSONLSink(Sink):
+    """Writes one JSON object per line."""
+
+    EXTENSION = ".jsonl"
+
+    def WriteRows(self, fd, rows):
+        fd.write("".join(
+            json.dumps(row) + "\n" for row in rows).encode("utf8"))
+
+
+def _Flatten(value):
+    if isinstance(value, (dict, list)):
+        return json.dumps(value)
+
+    return value
+
+
+class CSVSink(Sink):
+    """Writes CSV with a header row. A change of columns starts a new file."""
+
+    EXTENSION = ".csv"
+
+    def OpenFile(self, fd, columns):
+        self._text = io.TextIOWrapper(fd, encoding="utf8", newline="",
+                                      write_through=True)
+        self._writer = csv.writer(self._text)
+        self._writer.writerow(columns)
+
+    def CloseFile(self, fd):
+        self._text.detach()
+
+    def Compatible(self, columns):
+        return columns == self._columns
+
+    def WriteRows(self, fd, rows):
+        columns = self._columns
+        self._writer.writerows(
+            [_Flatten(row.get(c)) for c in columns] for row in rows)
+
+
+class _ArrowSink(Sink):
+    """Common code for the pyarrow based sinks."""
+
+    def __init__(self, path, max_rows=None, max_bytes=None):
+        try:
+            import pyarrow
+        except ImportError:
+            raise ImportError(
+                "The %s format needs pyarrow: pip install pyarrow" %
+                self.EXTENSION.lstrip("."))
+
+        self.pa = pyarrow
+        self._schema = None
+        self._table = None
+        super().__init__(path, max_rows=max_rows, max_bytes=max_bytes)
+
+    def _Table(self, rows, schema):
+        pa = self.pa
+        arrays = []
+        for c in self._columns:
+            values = [_Flatten(row.get(c)) for row in rows]
+            try:
+                arrays.append(pa.array(values))
+            except (pa.ArrowInvalid, pa.ArrowTypeError):
+                # Mixed types - fall back to strings.
+                arrays.append(pa.array([
+                    v if v is None or isinstance(v, str) else json.dumps(v)
+                    for v in values], type=pa.string()))
+
+        table = pa.Table.from_arrays(arrays, names=self._columns)
+        if schema is not None:
+            table = self._Cast(table, schema)
+
+        return table
+
+    def _Cast(self, table, schema):
+        pa = self.pa
+        arrays = []
+        for field, column in zip(schema, table.columns):
+            if column.type == field.type:
+                arrays.append(column)
+            elif pa.types.is_null(column.type):
+                arrays.append(pa.nulls(len(column), type=field.type))
+            else:
+                arrays.append(column.cast(field.type))
+
+        return pa.Table.from_arrays(arrays, schema=schema)
+
+    def Write(self, rows, columns):
+        # A batch whose types do not fit the current file's schema
+        # starts a new file.
+        self._table = None
+        if rows and self._fd is not None and self._schema is not None and (
+                list(columns) or list(rows[0])) == self._columns:
+            try:
+                self._table = self._Table(rows, self._schema)
+            except (self.pa.ArrowInvalid, self.pa.ArrowTypeError,
+                    self.pa.ArrowNotImplementedError):
+                self._Close()
+
+        super().Write(rows, columns)
+
+    def OpenFile(self, fd, columns):
+        self._schema = None
+        self._writer = None
+
+    def CloseFile(self, fd):
+        if self._writer is not None:
+            self._writer.close()
+
+        self._schema = None
+        self._writer = None
+
+    def Compatible(self, columns):
+        return columns == self._columns
+
+    def WriteRows(self, fd, rows):
+        table = self._table
+        if table is None:
+            table = self._Table(rows, self._schema)
+
+        if self._writer is None:
+            # Columns which are all null in the first batch get a string
+            # type so later batches with values still fit.
+            pa = self.pa
+            self._schema = pa.schema([
+                field.with_type(pa.string()) if pa.types.is_null(field.type)
+                else field for field in table.schema])
+            table = self._Cast(table, self._schema)
+            self._writer = self.NewWriter(fd, self._schema)
+
+        self._writer.write_table(table)
+
+
+class ParquetSink(_ArrowSink):
+    EXTENSION = ".parquet"
+
+    def NewWriter(self, fd, schema):
+        import pyarrow.parquet
+
+        return pyarrow.parquet.ParquetWriter(fd, schema)
+
+
+class ArrowSink(_ArrowSink):
+    """Writes the Arrow IPC stream format."""
+
+    EXTENSION = ".arrow"
+
+    def NewWriter(self, fd, schema):
+        return self.pa.ipc.new_stream(fd, schema)
+
+
+FORMATS = {
+    "jsonl": JSONLSink,
+    "csv": CSVSink,
+    "parquet": ParquetSink,
+    "arrow": ArrowSink,
+}
+
+
+def Open(path, format=None, max_rows=None, max_bytes=None):
+    """Opens a sink for path. The format defaults to the file extension."""
+    if format is None:
+        format = os.path.splitext(path)[1].lstrip(".").lower() or "jsonl"
+        if format == "json":
+            format = "jsonl"
+
+    try:
+        sink_cls = FORMATS[format]
+    except KeyError:
+        raise ValueError("Unknown output format %s. Known formats: %s" % (
+            format, ", ".join(FORMATS)))
+
+    return sink_cls(path, max_rows=max_rows, max_bytes=max_bytes)
@@ -0,0 +1,205 @@
+"""A resilient consumer for long running event queries.
+
+Event queries (e.g. watch_monitoring()) run forever, but a simple loop
+over stub.Query() ends on the first gRPC error, and a slow handler
+stalls reading from the stream. A Subscription reconnects with
+backoff and hands each row to a bounded pool of workers:
+
+```
+from pyvelociraptor import subscription
+
+def handler(row):
+    print(row["Name"])
+
+sub = subscription.Subscription('''
+   SELECT * from watch_monitoring(artifact='Windows.Events.ProcessCreation')
+''', handler, workers=8)
+sub.Run()
+```
+
+Unless the profile argument or the config's transport_profile says
+otherwise, the connection uses the long-lived-events transport profile
+(see client.PROFILES) so keepalives detect a dead connection.
+
+When the worker queue is full the reader stops pulling from the
+stream, which applies back pressure to the server rather than growing
+memory.
+
+On reconnect the query env has LastTimestamp set to the time (in
+seconds since the epoch) of the last response seen, so the query can
+replay the events it missed, for example:
+
+```
+SELECT * FROM chain(
+  a={ SELECT * FROM monitoring(artifact=Artifact)
+      WHERE LastTimestamp AND _ts > LastTimestamp },
+  b={ SELECT * FROM watch_monitoring(artifact=Artifact) })
+```
+"""
+import concurrent.futures
+import random
+import threading
+import time
+
+from pyvelociraptor import client
+from pyvelociraptor import decoder
+from pyvelociraptor import lazy
+
+grpc = lazy.Import("grpc")
+api_pb2 = lazy.Import("pyvelociraptor.api_pb2")
+
+
+class Subscription:
+    """Runs an event query and dispatches its rows to handler(row)."""
+
+    def __init__(self, query, handler, config=None, org_id=None, env=None,
+                 workers=4, queue_size=1000, use_processes=False,
+                 min_backoff=1, max_backoff=60, log=print,
+                 profile=None):
+        self.query = query
+        self.handler = handler
+        self.config = config
+        self.org_id = org_id
+        self.env = dict(env or {})
+        self.workers = max(1, workers)
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.use_processes = use_processes
+        self.log = log
+        self.profile = profile
+
+        # The timestamp (in microseconds) of the last response seen.
+        self.last_timestamp = 0
+
+        self.rows_received = 0
+        self.rows_handled = 0
+        self.errors = 0
+        self.reconnects = 0
+
+        self._slots = threading.BoundedSemaphore(queue_size)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._call = None
+        self._start = None
+
+    def _Request(self):
+        env = dict(self.env)
+        env["LastTimestamp"] = str(self.last_timestamp / 1000000)
+
+        return api_pb2.VQLCollectorArgs(
+            org_id=self.org_id or "",
+            max_wait=1,
+            env=[api_pb2.VQLEnv(key=k, value=v) for k,v in env.items()],
+            Query=[api_pb2.VQLRequest(
+                Name="Subscription",
+                VQL=self.query,
+            )])
+
+    def _Done(self, future):
+        self._slots.release()
+        error = None if future.cancelled() else future.exception()
+        with self._lock:
+            self.rows_handled += 1
+            if error is not None:
+                self.errors += 1
+
+        if error is not None and self.log:
+            self.log("Handler failed: %s: %s" % (type(error).__name__, error))
+
+    def _Dispatch(self, pool, row):
+        # Blocks while the queue is full.
+        while not self._slots.acquire(timeout=1):
+            if self._stop.is_set():
+                return
+
+        future = pool.submit(self.handler, row)
+        future.add_done_callback(self._Done)
+
+    def _Consume(self, pool):
+        stub = client.GetClient(self.config, profile=self.profile,
+                                default_profile="long-lived-events").stub()
+        self._call = stub.Query(self._Request())
+
+        for response in self._call:
+            if self._stop.is_set():
+                return
+
+            if response.timestamp:
+                self.last_timestamp = response.timestamp
+
+            if response.Response:
+                rows = decoder.DecodeResponse(response)
+                with self._lock:
+                    self.rows_received += len(rows)
+
+                for row in rows:
+                    self._Dispatch(pool, row)
+
+            elif response.log and self.log:
+                self.log("%s: %s" % (time.ctime(response.timestamp / 1000000),
+                                     response.log))
+
+    def Run(self):
+        """Runs the subscription until Stop() is called."""
+        if self.use_processes:
+            executor = concurrent.futures.ProcessPoolExecutor
+        else:
+            executor = concurrent.futures.ThreadPoolExecutor
+
+        self._start = time.time()
+        backoff = self.min_backoff
+        with executor(self.workers) as pool:
+            while not self._stop.is_set():
+                received = self.rows_received
+                try:
+                    self._Consume(pool)
+                    error = "stream ended"
+
+                except grpc.RpcError as e:
+                    if self._stop.is_set():
+                        break
+                    error = "%s: %s" % (e.code(), e.details())
+
+                # Start the backoff again once we got some data.
+                if self.rows_received > received:
+                    backoff = self.min_backoff
+
+                if self._stop.is_set():
+                    break
+
+                # Add jitter so many subscribers do not reconnect at
+                # the same time.
+                delay = backoff * (0.5 + random.random() / 2)
+                if self.log:
+                    self.log("Subscription lost (%s), reconnecting in %.1fs" % (
+                        error, delay))
+
+                self._stop.wait(delay)
+                backoff = min(backoff * 2, self.max_backoff)
+                self.reconnects += 1
+
+    def Stop(self):
+        self._stop.set()
+        call = self._call
+        if call is not None:
+            call.cancel()
+
+    def Stats(self):
+        """Returns a dict of lag and throughput metrics."""
+        elapsed = time.time() - self._start if self._start else 0
+        with self._lock:
+            handled = self.rows_handled
+            stats = dict(
+                rows_received=self.rows_received,
+                rows_handled=handled,
+                queued=self.rows_received - handled,
+                errors=self.errors,
+                reconnects=self.reconnects,
+                rows_per_second=handled / elapsed if elapsed else 0,
+            )
+
+        # How far behind the server's clock the last response is.
+        if self.last_timestamp:
+            stats["lag_seconds"] = max(0, time.time() - self.last_timestamp / 1000000)
+
+        return stats
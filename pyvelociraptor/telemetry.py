@@ -0,0 +1,390 @@
+"""Client side telemetry for API calls.
+
+Enable() installs a gRPC client interceptor on every channel opened by
+client.Client, and reports a CallStats for each completed call to the
+registered callbacks:
+
+```
+from pyvelociraptor import telemetry, velo_pandas
+
+collector = telemetry.Collector()
+telemetry.Enable(collector, telemetry.LogCallback())
+
+velo_pandas.DataFrameQuery("SELECT * FROM info()")
+print(collector.Summary())
+```
+
+Each CallStats records the time to the first response, the total
+latency, the number of response batches, the rows reported by the
+server (total_rows), the serialized size of the responses and the time
+spent decoding their JSON payloads. Decode time is attributed to the
+call whose response was most recently read in the same thread, which
+is how DataFrameQuery and the sample programs consume responses.
+
+Callbacks are plain callables taking a CallStats. Collector aggregates
+them per method and renders a summary or the Prometheus text format.
+OpenTelemetryCallback records them as OpenTelemetry metrics (pip
+install opentelemetry-api).
+
+Enable() must be called before the first query, since channels which
+are already open are not intercepted.
+"""
+import contextlib
+import sys
+import threading
+import time
+
+from pyvelociraptor import client
+from pyvelociraptor import decoder
+from pyvelociraptor import lazy
+
+grpc = lazy.Import("grpc")
+logging = lazy.Import("logging")
+
+
+class CallStats:
+    """Measurements for a single API call. Times are in seconds."""
+
+    def __init__(self, method):
+        self.method = method
+        self.start = time.perf_counter()
+        self.time_to_first_response = None
+        self.latency = None
+        self.batches = 0
+        self.rows = 0
+        self.bytes = 0
+        self.decode_time = 0
+        self.error = None
+
+        # Set when the client cancelled the call on purpose (e.g. the
+        # losing read of a hedged request). This is not an error.
+        self.cancelled = False
+
+        # Query responses report the running total_rows per query.
+        self._query_rows = {}
+
+    def _Response(self, response):
+        if self.time_to_first_response is None:
+            self.time_to_first_response = time.perf_counter() - self.start
+
+        self.batches += 1
+        self.bytes += response.ByteSize()
+
+        total_rows = getattr(response, "total_rows", 0)
+        if total_rows:
+            self._query_rows[response.Query.Name] = total_rows
+            self.rows = sum(self._query_rows.values())
+
+    def _Finish(self, error=None, cancelled=False):
+        self.latency = time.perf_counter() - self.start
+        self.error = error
+        self.cancelled = cancelled
+
+    def AsDict(self):
+        return dict(method=self.method,
+                    time_to_first_response=self.time_to_first_response,
+                    latency=self.latency,
+                    batches=self.batches,
+                    rows=self.rows,
+                    bytes=self.bytes,
+                    decode_time=self.decode_time,
+                    error=self.error,
+                    cancelled=self.cancelled)
+
+    def __repr__(self):
+        return "<CallStats %s>" % self.AsDict()
+
+
+_callbacks = []
+_lock = threading.Lock()
+_interceptor = None
+
+# The CallStats of the call whose response this thread read last.
+_current = threading.local()
+
+
+def _Report(stats):
+    for callback in list(_callbacks):
+        try:
+            callback(stats)
+        except Exception as e:
+            logging.getLogger(__name__).warning(
+                "Telemetry callback %r failed: %s", callback, e)
+
+
+def _ObserveDecode(response, elapsed):
+    stats = getattr(_current, "stats", None)
+    if stats is not None:
+        stats.decode_time += elapsed
+
+
+def _ErrorCode(error):
+    if isinstance(error, grpc.RpcError):
+        return str(error.code())
+
+    return type(error).__name__
+
+
+class _StreamingCall:
+    """Wraps a response stream, recording stats as it is consumed.
+
+    Other attributes (cancel(), code() etc) are passed to the call.
+    """
+
+    def __init__(self, call, stats):
+        self._call = call
+        self._stats = stats
+        self._done = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            response = next(self._call)
+        except StopIteration:
+            self._Finish()
+            raise
+        except Exception as e:
+            self._Finish(_ErrorCode(e))
+            raise
+
+        self._stats._Response(response)
+        _current.stats = self._stats
+        return response
+
+    def _Finish(self, error=None, cancelled=False):
+        if not self._done:
+            self._done = True
+            if getattr(_current, "stats", None) is self._stats:
+                _current.stats = None
+            self._stats._Finish(error, cancelled)
+            _Report(self._stats)
+
+    def cancel(self):
+        # Cancelled streams are reported as they are never read to the
+        # end.
+        result = self._call.cancel()
+        self._Finish(cancelled=True)
+        return result
+
+    def __getattr__(self, name):
+        return getattr(self._call, name)
+
+
+def _NewInterceptor():
+    # Defined here so grpc is only imported when telemetry is enabled.
+    class Interceptor(grpc.UnaryUnaryClientInterceptor,
+                      grpc.UnaryStreamClientInterceptor):
+
+        def intercept_unary_unary(self, continuation, details, request):
+            stats = CallStats(details.method)
+            outcome = continuation(details, request)
+
+            def done(future):
+                # exception() raises on a cancelled call (e.g. the
+                # losing read of a hedged request).
+                if future.cancelled():
+                    stats._Finish(cancelled=True)
+                    _Report(stats)
+                    return
+
+                error = future.exception()
+                if error is None:
+                    stats._Response(future.result())
+                    stats._Finish()
+                else:
+                    stats._Finish(_ErrorCode(error))
+                _Report(stats)
+
+            outcome.add_done_callback(done)
+            return outcome
+
+        def intercept_unary_stream(self, continuation, details, request):
+            stats = CallStats(details.method)
+            return _StreamingCall(continuation(details, request), stats)
+
+    return Interceptor()
+
+
+def AddCallback(callback):
+    """Adds a callable which receives a CallStats for every call."""
+    with _lock:
+        if callback not in _callbacks:
+            _callbacks.append(callback)
+
+
+def RemoveCallback(callback):
+    with _lock:
+        if callback in _callbacks:
+            _callbacks.remove(callback)
+
+
+def Enable(*callbacks):
+    """Instruments new channels and reports calls to the callbacks."""
+    global _interceptor
+
+    with _lock:
+        if _interceptor is None:
+            _interceptor = _NewInterceptor()
+            client.AddInterceptor(_interceptor)
+            decoder.SetObserver(_ObserveDecode)
+
+    for callback in callbacks:
+        AddCallback(callback)
+
+
+@contextlib.contextmanager
+def PrintSummary(enabled=True, fd=None):
+    """Prints a summary of the calls made in the block to fd (stderr).
+
+    This implements the --stats flag of the sample programs.
+    """
+    if not enabled:
+        yield None
+        return
+
+    collector = Collector()
+    Enable(collector)
+    try:
+        yield collector
+    finally:
+        RemoveCallback(collector)
+        print(collector.Summary(), file=fd or sys.stderr)
+
+
+def LogCallback(logger=None, level=None):
+    """Returns a callback which logs a line per call (at INFO level)."""
+    logger = logger or logging.getLogger(__name__)
+    if level is None:
+        level = logging.INFO
+
+    def log(stats):
+        logger.log(level,
+                   "%s: %s latency %.3fs first response %s batches %d "
+                   "rows %d bytes %d decode %.3fs",
+                   stats.method,
+                   stats.error or ("CANCELLED" if stats.cancelled else "OK"),
+                   stats.latency,
+                   "-" if stats.time_to_first_response is None else
+                   "%.3fs" % stats.time_to_first_response,
+                   stats.batches, stats.rows, stats.bytes, stats.decode_time)
+
+    return log
+
+
+class Collector:
+    """A callback which aggregates stats per method."""
+
+    FIELDS = ["calls", "errors", "cancelled", "latency", "time_to_first_response",
+              "batches", "rows", "bytes", "decode_time"]
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.methods = {}
+
+    def __call__(self, stats):
+        with self._lock:
+            totals = self.methods.get(stats.method)
+            if totals is None:
+                totals = self.methods[stats.method] = dict.fromkeys(
+                    self.FIELDS, 0)
+
+            totals["calls"] += 1
+            if stats.error:
+                totals["errors"] += 1
+            if stats.cancelled:
+                totals["cancelled"] += 1
+            totals["latency"] += stats.latency
+            totals["time_to_first_response"] += stats.time_to_first_response or 0
+            totals["batches"] += stats.batches
+            totals["rows"] += stats.rows
+            totals["bytes"] += stats.bytes
+            totals["decode_time"] += stats.decode_time
+
+    def Summary(self):
+        """Returns a human readable table of the totals."""
+        lines = ["%-28s %6s %6s %9s %9s %9s %8s %10s %12s %9s" % (
+            "Method", "Calls", "Errors", "Cancelled", "Latency", "First", "Batches",
+            "Rows", "Bytes", "Decode")]
+
+        with self._lock:
+            for method, t in sorted(self.methods.items()):
+                lines.append(
+                    "%-28s %6d %6d %9d %8.3fs %8.3fs %8d %10d %12d %8.3fs" % (
+                        method.rsplit("/", 1)[-1], t["calls"], t["errors"],
+                        t["cancelled"],
+                        t["latency"], t["time_to_first_response"],
+                        t["batches"], t["rows"], t["bytes"],
+                        t["decode_time"]))
+
+        return "\n".join(lines)
+
+    def PrometheusText(self, prefix="pyvelociraptor_client"):
+        """Returns the totals in the Prometheus text exposition format."""
+        metrics = [
+            ("calls", "calls_total", "counter", "API calls made."),
+            ("errors", "errors_total", "counter", "API calls which failed."),
+            ("cancelled", "cancelled_total", "counter",
+             "API calls cancelled by the client."),
+            ("latency", "latency_seconds_total", "counter",
+             "Total time spent in API calls."),
+            ("time_to_first_response", "first_response_seconds_total",
+             "counter", "Total time to the first response."),
+            ("batches", "responses_total", "counter", "Responses received."),
+            ("rows", "rows_total", "counter", "Rows received."),
+            ("bytes", "response_bytes_total", "counter",
+             "Serialized size of the responses."),
+            ("decode_time", "decode_seconds_total", "counter",
+             "Time spent decoding JSON payloads."),
+        ]
+
+        lines = []
+        with self._lock:
+            for field, name, kind, help in metrics:
+                name = "%s_%s" % (prefix, name)
+                lines.append("# HELP %s %s" % (name, help))
+                lines.append("# TYPE %s %s" % (name, kind))
+                for method, totals in sorted(self.methods.items()):
+                    lines.append('%s{method="%s"} %s' % (
+                        name, method, totals[field]))
+
+        return "\n".join(lines) + "\n"
+
+
+class OpenTelemetryCallback:
+    """Records calls as OpenTelemetry metrics.
+
+    Uses the global meter provider unless a meter is given.
+    """
+
+    def __init__(self, meter=None):
+        try:
+            from opentelemetry import metrics
+        except ImportError:
+            raise ImportError(
+                "OpenTelemetryCallback needs opentelemetry: "
+                "pip install opentelemetry-api")
+
+        meter = meter or metrics.get_meter("pyvelociraptor")
+        self.latency = meter.create_histogram(
+            "pyvelociraptor.client.latency", unit="s")
+        self.first_response = meter.create_histogram(
+            "pyvelociraptor.client.first_response", unit="s")
+        self.decode_time = meter.create_histogram(
+            "pyvelociraptor.client.decode_time", unit="s")
+        self.batches = meter.create_counter("pyvelociraptor.client.responses")
+        self.rows = meter.create_counter("pyvelociraptor.client.rows")
+        self.bytes = meter.create_counter(
+            "pyvelociraptor.client.response_bytes", unit="By")
+
+    def __call__(self, stats):
+        attributes = {"method": stats.method, "error": stats.error or "",
+                      "cancelled": stats.cancelled}
+        self.latency.record(stats.latency, attributes)
+        if stats.time_to_first_response is not None:
+            self.first_response.record(stats.time_to_first_response, attributes)
+        self.decode_time.record(stats.decode_time, attributes)
+        self.batches.add(stats.batches, attributes)
+        self.rows.add(stats.rows, attributes)
+        self.bytes.add(stats.bytes, attributes)
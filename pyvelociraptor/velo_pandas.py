@@ -71,55 +71,440 @@ df = pandas.DataFrame(velo_pandas.DataFrameQuery(```
 df.head(500)
 ```
 
-"""
-import json
-import grpc
-import os
-import os.path
+For very large result sets (e.g. hunt_results() of a big hunt) use
+DataFrameQueryIterator() to process the results in chunks without
+holding them all in memory:
+
+```
+for df in velo_pandas.DataFrameQueryIterator(```
+  SELECT * FROM hunt_results(hunt_id=HuntId,
+ artifact='Windows.System.Pslist') ```,
+      chunk_rows=100000, as_dataframe=True, HuntId=HuntId):
+    process(df)
+```
+
+To read the results of a big hunt faster, pyvelociraptor.hunts reads
+shards of the hunt's flows with concurrent queries.
+
+Re-running cells which query immutable data (results of a finished
+hunt or flow) can be served from a local disk cache instead of the
+server. The cache is opt in (see pyvelociraptor.cache):
 
-import pyvelociraptor
+```
+velo_pandas.EnableCache(max_bytes=2 * 1024**3, ttl=7 * 24 * 3600)
+```
+
+DataFrame() (and DataFrameQuery(typed=True)) use the column types sent
+by the server to build typed columns: int64, float64, bool and
+datetime64 for timestamps, with low cardinality strings stored as
+categoricals. This makes pandas operations vectorized and uses much
+less memory than columns of Python objects.
+
+"""
 
 from pyvelociraptor import api_pb2
-from pyvelociraptor import api_pb2_grpc
-
-
-def DataFrameQuery(query, timeout=600, org_id=None, config=None, **kw):
-    if config is None:
-        config = pyvelociraptor.LoadConfigFile()
-
-    creds = grpc.ssl_channel_credentials(
-        root_certificates=config["ca_certificate"].encode("utf8"),
-        private_key=config["client_private_key"].encode("utf8"),
-        certificate_chain=config["client_cert"].encode("utf8"))
-
-    # This option is required to connect to the grpc server by IP - we
-    # use self signed certs.
-    options = (('grpc.ssl_target_name_override', "VelociraptorServer",),)
-
-    # The first step is to open a gRPC channel to the server..
-    with grpc.secure_channel(config["api_connection_string"],
-                             creds, options) as channel:
-        stub = api_pb2_grpc.APIStub(channel)
-
-        # The request consists of one or more VQL queries. Note that
-        # you can collect server artifacts by simply naming them using the
-        # "Artifact" plugin (i.e. `SELECT * FROM Artifact.Server.Hunts.List()` )
-        request = api_pb2.VQLCollectorArgs(
-          org_id = org_id or "",  
-          max_wait=1,
-            env=[api_pb2.VQLEnv(key=k, value=v) for k,v in kw.items()],
-            Query=[api_pb2.VQLRequest(
-                Name="Query",
-                VQL=query,
-            )])
-
-        result = {}
-        for response in stub.Query(request):
-            if not response.Response:
-                continue
-
-            for row in json.loads(response.Response):
-                for c in response.Columns:
-                    result.setdefault(c, []).append(row.get(c))
-
-        return result
+from pyvelociraptor import cache as cache_lib
+from pyvelociraptor import client
+from pyvelociraptor import decoder
+
+
+def QueryRequest(query, org_id=None, max_row=0, max_wait=1, **kw):
+    """Builds the VQLCollectorArgs for a single query.
+
+    Keyword args are passed to the query as env parameters.
+    """
+    return MultiQueryRequest({"Query": query}, org_id=org_id,
+                             max_row=max_row, max_wait=max_wait, **kw)
+
+
+def MultiQueryRequest(queries, org_id=None, max_row=0, max_wait=1, **kw):
+    """Builds the VQLCollectorArgs for a dict of named queries.
+
+    All the queries share the same env. The name of each query is
+    returned in the Query field of its responses.
+    """
+    # The request consists of one or more VQL queries. Note that
+    # you can collect server artifacts by simply naming them using the
+    # "Artifact" plugin (i.e. `SELECT * FROM Artifact.Server.Hunts.List()` )
+    return api_pb2.VQLCollectorArgs(
+        org_id=org_id or "",
+        max_row=max_row,
+        max_wait=max_wait,
+        env=[api_pb2.VQLEnv(key=k, value=v) for k,v in kw.items()],
+        Query=[api_pb2.VQLRequest(Name=name, VQL=query)
+               for name, query in queries.items()])
+
+
+# The result cache used by DataFrameQuery (see EnableCache).
+_result_cache = None
+
+
+def EnableCache(path="~/.cache/pyvelociraptor", max_bytes=1024 * 1024 * 1024,
+                ttl=None):
+    """Caches the results of DataFrameQuery on disk.
+
+    Only enable this for queries over immutable data (e.g. results of
+    finished hunts or flows). Use cache=False on a single call to
+    bypass the cache - the wrappers module does this for queries which
+    launch collections or look up clients.
+    """
+    global _result_cache
+
+    _result_cache = cache_lib.ResultCache(path, max_bytes=max_bytes, ttl=ttl)
+    return _result_cache
+
+
+def DisableCache():
+    global _result_cache
+
+    _result_cache = None
+
+
+def InvalidateCache(query, org_id=None, config=None, **kw):
+    """Removes the cached result of this query."""
+    if _result_cache is not None:
+        _result_cache.Invalidate(_CacheKey(_result_cache, query, org_id,
+                                           config, kw))
+
+
+def _CacheKey(result_cache, query, org_id, config, env):
+    server = client.GetClient(config).config["api_connection_string"]
+    return result_cache.Key(server, query, env, org_id)
+
+
+def DataFrameQuery(query, timeout=600, org_id=None, config=None,
+                   max_row=0, max_wait=1, cache=None, typed=False, **kw):
+    # Cache may be a cache.ResultCache, None to use the cache set by
+    # EnableCache() or False to skip caching.
+    result_cache = _result_cache if cache is None else cache
+
+    # With typed set the columns are converted to typed arrays (see
+    # ConvertColumns) using the column types the server sends.
+    if result_cache:
+        key = _CacheKey(result_cache, query, org_id, config, kw)
+        entry = result_cache.GetWithTypes(key)
+        if entry is not None:
+            result, types = entry
+            return ConvertColumns(result, types) if typed else result
+
+    # The client keeps a warm channel to the server so repeated
+    # queries do not pay for a new TLS handshake. Config may also be a
+    # client.Client instance.
+    stub = client.GetClient(config).stub()
+
+    request = QueryRequest(query, org_id=org_id, max_row=max_row,
+                           max_wait=max_wait, **kw)
+
+    types = {}
+    result = ResponseColumns(ResponseTypes(stub.Query(request), types))
+    if result_cache:
+        result_cache.Set(key, result, types=types)
+
+    if typed:
+        return ConvertColumns(result, types)
+
+    return result
+
+
+def DataFrameQueryIterator(query, chunk_rows=None, as_dataframe=False,
+                           timeout=600, org_id=None, config=None,
+                           max_row=0, max_wait=1, typed=False, **kw):
+    """Runs the query and yields the results in chunks.
+
+    Unlike DataFrameQuery the full result set is never held in
+    memory. Each chunk is a dict of columns (or a pandas DataFrame if
+    as_dataframe is set). If chunk_rows is None, one chunk is yielded
+    per response batch from the server, otherwise chunks of exactly
+    chunk_rows rows are yielded (the last one may be shorter).
+
+    max_row and max_wait control how the server batches the responses.
+    If typed is set each chunk is converted with ConvertColumns.
+    """
+    stub = client.GetClient(config).stub()
+
+    request = QueryRequest(query, org_id=org_id, max_row=max_row,
+                           max_wait=max_wait, **kw)
+
+    if as_dataframe:
+        import pandas
+
+        convert = pandas.DataFrame
+    else:
+        convert = lambda columns: columns
+
+    types = {}
+    responses = ResponseTypes(stub.Query(request), types)
+    for columns in ResponseChunks(responses, chunk_rows):
+        if typed:
+            columns = ConvertColumns(columns, types)
+
+        yield convert(columns)
+
+
+def QueryRows(query, timeout=600, org_id=None, config=None,
+              max_row=0, max_wait=1, **kw):
+    """Runs the query and yields each row as a compact decoder.Row.
+
+    Rows are much smaller than dicts and share repeated string values,
+    so this suits consumers which keep many rows. A list of rows can be
+    turned into a DataFrame with
+    pandas.DataFrame.from_records(rows, columns=rows[0].keys()).
+    """
+    stub = client.GetClient(config).stub()
+
+    request = QueryRequest(query, org_id=org_id, max_row=max_row,
+                           max_wait=max_wait, **kw)
+
+    # Shares repeated string values between rows. Reset now and then
+    # so it does not grow without bound on long queries.
+    strings = {}
+    for response in stub.Query(request):
+        if len(strings) > 100000:
+            strings = {}
+
+        yield from decoder.DecodeRows(response, strings)
+
+
+def DataFrameMultiQuery(queries, org_id=None, config=None,
+                        max_row=0, max_wait=1, **kw):
+    """Runs many named queries in a single Query call.
+
+    queries is a dict of name -> VQL. Returns a dict of name -> dict of
+    columns (as returned by DataFrameQuery). Queries which returned no
+    rows map to an empty dict.
+    """
+    stub = client.GetClient(config).stub()
+
+    request = MultiQueryRequest(queries, org_id=org_id, max_row=max_row,
+                                max_wait=max_wait, **kw)
+
+    batches = {name: [] for name in queries}
+    for columns, count, name in _NamedResponseBatches(stub.Query(request)):
+        batches.setdefault(name, []).append((columns, count))
+
+    return {name: _ConcatBatches(x) for name, x in batches.items()}
+
+
+def MultiQueryIterator(queries, as_dataframe=False, org_id=None,
+                       config=None, max_row=0, max_wait=1, **kw):
+    """Runs many named queries in a single Query call.
+
+    Yields (name, columns) for each response batch as it arrives, so
+    the results of the different queries are interleaved.
+    """
+    stub = client.GetClient(config).stub()
+
+    request = MultiQueryRequest(queries, org_id=org_id, max_row=max_row,
+                                max_wait=max_wait, **kw)
+
+    if as_dataframe:
+        import pandas
+
+        convert = pandas.DataFrame
+    else:
+        convert = lambda columns: columns
+
+    for columns, _, name in _NamedResponseBatches(stub.Query(request)):
+        yield name, convert(columns)
+
+
+def DataFrame(query, timeout=600, org_id=None, config=None, typed=True,
+              **kw):
+    """Runs the query and returns a pandas DataFrame directly.
+
+    Columns are typed (see ConvertColumns) unless typed is False.
+    """
+    import pandas
+
+    return pandas.DataFrame(DataFrameQuery(
+        query, timeout=timeout, org_id=org_id, config=config, typed=typed,
+        **kw))
+
+
+# Maps the column types in VQLResponse.types to the kind of array
+# ConvertColumns builds. Types which are not listed are left alone.
+COLUMN_TYPES = {
+    "int": "int64",
+    "int64": "int64",
+    "integer": "int64",
+    "uint64": "int64",
+    "float": "float64",
+    "float64": "float64",
+    "double": "float64",
+    "bool": "bool",
+    "boolean": "bool",
+    "timestamp": "datetime64",
+    "time": "datetime64",
+    "datetime": "datetime64",
+}
+
+
+def ResponseTypes(responses, types):
+    """Passes responses through, recording their column types in types."""
+    for response in responses:
+        for item in response.types:
+            types[item.column] = item.type
+
+        yield response
+
+
+def _ConvertColumn(values, kind, categorical):
+    import numpy
+    import pandas
+
+    # The JSON types present in the column. Values must all be of the
+    # expected type - numpy would otherwise happily truncate floats or
+    # treat strings as True.
+    classes = set(map(type, values))
+    has_nulls = type(None) in classes
+    classes.discard(type(None))
+
+    if kind == "int64" and classes <= {int}:
+        if has_nulls:
+            return pandas.array(values, dtype="Int64")
+        return numpy.array(values, dtype=numpy.int64)
+
+    if kind == "float64" and classes <= {int, float}:
+        # Nulls become NaN.
+        return numpy.array(values, dtype=numpy.float64)
+
+    if kind == "bool" and classes <= {bool}:
+        if has_nulls:
+            return pandas.array(values, dtype="boolean")
+        return numpy.array(values, dtype=bool)
+
+    if kind == "datetime64":
+        if classes <= {int, float}:
+            # Seconds since the epoch.
+            return pandas.to_datetime(values, unit="s", utc=True)
+
+        if classes <= {str}:
+            try:
+                return pandas.to_datetime(values, utc=True, format="ISO8601")
+            except ValueError:
+                # Older pandas does not know the ISO8601 format.
+                return pandas.to_datetime(values, utc=True)
+
+    if (kind is None and categorical and classes == {str}
+        and len(set(values)) <= len(values) * categorical):
+        return pandas.Categorical(values)
+
+    return values
+
+
+def ConvertColumns(columns, types=None, categorical=0.5):
+    """Converts a dict of column lists into typed arrays.
+
+    types maps column names to VQL types (as sent in
+    VQLResponse.types, see COLUMN_TYPES). Integer, float and bool
+    columns become numpy arrays (or pandas nullable arrays if they
+    have nulls) and timestamps become UTC datetime64 arrays. Untyped
+    string columns with at most `categorical` distinct values per row
+    become pandas Categoricals (set categorical to None to disable).
+
+    Columns whose values do not fit their type are left as lists. The
+    result initializes a pandas DataFrame just like the input.
+    """
+    types = types or {}
+
+    result = {}
+    for name, values in columns.items():
+        kind = COLUMN_TYPES.get((types.get(name) or "").lower())
+        try:
+            result[name] = _ConvertColumn(values, kind, categorical)
+        except (ValueError, TypeError, OverflowError):
+            result[name] = values
+
+    return result
+
+
+def BatchColumns(response):
+    """Converts a single VQLResponse into a dict of column lists."""
+    rows = decoder.DecodeResponse(response)
+    return {c: [row.get(c) for row in rows] for c in response.Columns}, len(rows)
+
+
+def _ResponseBatches(responses):
+    for columns, count, _ in _NamedResponseBatches(responses):
+        yield columns, count
+
+
+def _NamedResponseBatches(responses):
+    for response in responses:
+        if not response.Response:
+            continue
+
+        columns, count = BatchColumns(response)
+        if count:
+            yield columns, count, response.Query.Name
+
+
+def _ConcatBatches(batches):
+    names = {}
+    for columns, _ in batches:
+        for c in columns:
+            names.setdefault(c, None)
+
+    result = {}
+    for c in names:
+        column = result[c] = []
+        for columns, count in batches:
+            values = columns.get(c)
+            if values is None:
+                column.extend([None] * count)
+            else:
+                column.extend(values)
+
+    return result
+
+
+def MergeColumns(results):
+    """Concatenates a list of dicts of columns into one."""
+    return _ConcatBatches([
+        (columns, len(next(iter(columns.values()), [])))
+        for columns in results])
+
+
+def ResponseColumns(responses):
+    """Assembles a stream of VQLResponse messages into a dict of columns.
+
+    Each batch is converted to columns on its own and all the batches
+    are concatenated once at the end. Columns which are missing from
+    some batches are padded with None so all columns have the same
+    length.
+    """
+    return _ConcatBatches(list(_ResponseBatches(responses)))
+
+
+def ResponseChunks(responses, chunk_rows=None):
+    """Yields dicts of columns from a stream of VQLResponse messages.
+
+    If chunk_rows is None each response batch is yielded on its own,
+    otherwise batches are regrouped into chunks of chunk_rows rows.
+    """
+    if not chunk_rows:
+        for columns, _ in _ResponseBatches(responses):
+            yield columns
+        return
+
+    pending = []
+    total = 0
+    for columns, count in _ResponseBatches(responses):
+        pending.append((columns, count))
+        total += count
+        if total < chunk_rows:
+            continue
+
+        merged = _ConcatBatches(pending)
+        offset = 0
+        while total - offset >= chunk_rows:
+            yield {c: v[offset:offset + chunk_rows] for c, v in merged.items()}
+            offset += chunk_rows
+
+        pending = []
+        total -= offset
+        if total:
+            pending.append(({c: v[offset:] for c, v in merged.items()}, total))
+
+    if pending:
+        yield _ConcatBatches(pending)
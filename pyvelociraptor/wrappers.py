@@ -1,5 +1,12 @@
-from pyvelociraptor.velo_pandas import DataFrameQuery
+from pyvelociraptor.velo_pandas import DataFrameQuery, QueryRequest
 from pyvelociraptor import LoadConfigFile
+from pyvelociraptor import client
+from pyvelociraptor import decoder
+import concurrent.futures
+import grpc
+import json
+import os
+import threading
 import pandas as pd
 import time
 
@@ -7,7 +14,232 @@ pd.set_option('display.max_colwidth', None)
 pd.set_option('display.max_columns', None)
 pd.set_option('display.max_rows', None)
 
-def run_artifact(hostname, artifact_name, config=None, artifact_parameters=None, limit=None, artifact_collect_name=None, verbose=True, timeout=600):
+# Checks the flow states and watches for the completion events at the
+# same time, so a flow which finishes before the watch starts is still
+# seen. The two run in parallel, so a flow which finishes after the
+# first check but before the watch is registered would be missed - the
+# states are therefore checked again every PollPeriod seconds. Only
+# FINISHED and ERROR are final - flows may also be UNSET, IN_PROGRESS or
+# UNRESPONSIVE.
+WAIT_FOR_FLOWS_QUERY = """
+    LET flows_list <= parse_json_array(data=Flows)
+    LET flow_ids <= flows_list.flow_id
+
+    LET finished_flows = SELECT * FROM foreach(row=flows_list, query={
+        SELECT flow_id AS FlowId, state
+        FROM flows(client_id=client_id, flow_id=flow_id)
+        WHERE state =~ '^(FINISHED|ERROR)$'
+      })
+
+    SELECT * FROM chain(async=TRUE,
+      a=finished_flows,
+      b={
+        SELECT FlowId, Flow.state AS state
+        FROM watch_monitoring(artifact='System.Flow.Completion')
+        WHERE FlowId IN flow_ids
+      },
+      c={
+        SELECT * FROM foreach(
+          row={ SELECT * FROM clock(period=int(int=PollPeriod)) },
+          query=finished_flows)
+      })"""
+
+
+def wait_for_flows(flows, config=None, timeout=600, poll_period=30):
+    """
+    # [Waits for many flows to complete using the System.Flow.Completion event]
+    # flows is a list of (client_id, flow_id) tuples. The flow states
+    # are also checked every poll_period seconds as a fallback.
+
+    # Yields:
+    #     [tuple]: [(flow_id, state) for each flow as it completes.]
+    """
+    remaining = set(flow_id for _, flow_id in flows)
+    if not remaining:
+        return
+
+    stub = client.GetClient(config).stub()
+    request = QueryRequest(WAIT_FOR_FLOWS_QUERY, Flows=json.dumps([
+        dict(client_id=client_id, flow_id=flow_id)
+        for client_id, flow_id in flows]), PollPeriod=str(int(poll_period)))
+
+    # The server stops the query after the timeout - the deadline is
+    # just a backstop in case the server goes away.
+    request.timeout = int(timeout)
+
+    responses = stub.Query(request, timeout=timeout + 30)
+    try:
+        for response in responses:
+            if not response.Response:
+                continue
+
+            for row in decoder.DecodeResponse(response):
+                flow_id = row.get("FlowId")
+                if flow_id not in remaining:
+                    continue
+
+                remaining.discard(flow_id)
+                yield flow_id, row.get("state") or "FINISHED"
+
+            if not remaining:
+                return
+
+    except grpc.RpcError as e:
+        if e.code() != grpc.StatusCode.DEADLINE_EXCEEDED:
+            raise
+
+    finally:
+        responses.cancel()
+
+
+def wait_for_flow(client_id, flow_id, config=None, timeout=600):
+    """
+    # [Waits for the flow to complete using the System.Flow.Completion event]
+
+    # Returns:
+    #     [str]: [The final flow state (e.g. FINISHED or ERROR) or None on timeout.]
+    """
+    for _, state in wait_for_flows([(client_id, flow_id)],
+                                   config=config, timeout=timeout):
+        return state
+
+    return None
+
+
+RESOLVE_CLIENTS_QUERY = """
+    SELECT * FROM foreach(row=parse_json_array(data=Hostnames), query={
+      SELECT _value AS Hostname, client_id
+      FROM clients(search=_value)
+      LIMIT 1
+    })"""
+
+ALL_CLIENTS_QUERY = """
+    SELECT client_id, os_info.hostname AS Hostname, os_info.fqdn AS Fqdn
+    FROM clients()"""
+
+
+class ClientIdCache:
+    """
+    # [Caches hostname to client_id lookups for ttl seconds]
+    # Entries are kept per server. If path is given the cache is
+    # loaded from and saved to this JSON file.
+
+    # >>> cache = wrappers.ClientIdCache(ttl=86400, path="~/.pyvelociraptor_clients.json")
+    # >>> cache.warm(config)
+    # >>> df = wrappers.run_artifact("MY_HOSTNAME", "Windows.System.Pslist", cache=cache)
+    """
+    def __init__(self, ttl=3600, path=None):
+        self.ttl = ttl
+        self.path = path and os.path.expanduser(path)
+        self._entries = {}
+        self._lock = threading.Lock()
+
+        if self.path and os.path.exists(self.path):
+            try:
+                with open(self.path) as fd:
+                    self._entries = json.load(fd)
+            except (OSError, ValueError):
+                self._entries = {}
+
+    def _server(self, config):
+        return client.GetClient(config).config["api_connection_string"]
+
+    def get(self, hostname, config=None):
+        with self._lock:
+            entry = self._entries.get(self._server(config), {}).get(hostname.lower())
+
+        if entry and time.time() - entry[1] < self.ttl:
+            return entry[0]
+
+        return None
+
+    def update(self, mapping, config=None):
+        """Adds a dict of hostname -> client_id to the cache."""
+        now = time.time()
+        with self._lock:
+            entries = self._entries.setdefault(self._server(config), {})
+            for hostname, cid in mapping.items():
+                if hostname and cid:
+                    entries[hostname.lower()] = [cid, now]
+
+        self.save()
+
+    def invalidate(self, hostname=None, config=None):
+        """Removes a hostname (or everything if not given) from the cache."""
+        with self._lock:
+            if hostname is None:
+                self._entries = {}
+            else:
+                self._entries.get(self._server(config), {}).pop(hostname.lower(), None)
+
+        self.save()
+
+    def save(self):
+        if not self.path:
+            return
+
+        with self._lock:
+            tmp = self.path + ".tmp"
+            with open(tmp, "w") as fd:
+                json.dump(self._entries, fd)
+            os.replace(tmp, self.path)
+
+    def warm(self, config=None):
+        """Loads all clients from the server with a single clients() query."""
+        # Always asks the server - this cache has its own ttl.
+        result = DataFrameQuery(ALL_CLIENTS_QUERY, config=config, cache=False)
+        mapping = {}
+        for cid, hostname, fqdn in zip(result.get("client_id", []),
+                                       result.get("Hostname", []),
+                                       result.get("Fqdn", [])):
+            mapping[hostname] = cid
+            mapping[fqdn] = cid
+
+        self.update(mapping, config=config)
+        return len(result.get("client_id", []))
+
+    def resolve(self, hostnames, config=None):
+        """
+        # Returns a dict of hostname -> client_id. Hostnames which are
+        # not cached are looked up together in a single query.
+        """
+        result = {}
+        missing = []
+        for hostname in hostnames:
+            cid = self.get(hostname, config=config)
+            if cid:
+                result[hostname] = cid
+            else:
+                missing.append(hostname)
+
+        if missing:
+            resolved = DataFrameQuery(RESOLVE_CLIENTS_QUERY, config=config,
+                                      cache=False,
+                                      Hostnames=json.dumps(missing))
+            found = dict(zip(resolved.get("Hostname", []),
+                             resolved.get("client_id", [])))
+            self.update(found, config=config)
+            result.update(found)
+
+        return result
+
+
+# The cache used by run_artifact() and run_artifact_multi() by default.
+CLIENT_ID_CACHE = ClientIdCache()
+
+
+def _resolve(cache, hostnames, config):
+    # cache=None uses the default cache, cache=False disables caching.
+    if cache is None:
+        cache = CLIENT_ID_CACHE
+
+    if cache is False:
+        return ClientIdCache(ttl=0).resolve(hostnames, config=config)
+
+    return cache.resolve(hostnames, config=config)
+
+
+def run_artifact(hostname, artifact_name, config=None, artifact_parameters=None, limit=None, artifact_collect_name=None, verbose=True, timeout=600, cache=None):
     """
     # [Instantiates artifact for specific hostname and returns it's results as a pandas DataFrame]
     # Examples:
@@ -29,9 +261,8 @@ def run_artifact(hostname, artifact_name, config=None, artifact_parameters=None,
     #             artifact='Windows.System.Pslist',
     #             client_id="C.869eb611eaa5b899", flow_id='F.BVSSIUHNPUV7E') 
 
-    # [!] Artifact is running... 0s
-    # [!] Artifact is running... 5.3s
-    # [+] Done! 11.0s
+    # [!] Artifact is running... waiting for flow completion
+    # [+] Done! 6.2s
 
     # >>> wrappers.run_artifact("NON_EXISTENT_HOSTNAME", "Windows.System.Pslist")
     # [-] Cannot find any Client ID by provided hostname.
@@ -54,11 +285,9 @@ def run_artifact(hostname, artifact_name, config=None, artifact_parameters=None,
         config = LoadConfigFile()
 
     # FINDING CLIENT_ID FROM HOSTNAME
-    cid_query = DataFrameQuery(f"""
-    SELECT client_id FROM clients(search=Hostname)
-    """, config=config, Hostname=hostname)
-    if cid_query:
-        cid = cid_query["client_id"][0]
+    # Repeated lookups are answered from the cache without a round trip.
+    cid = _resolve(cache, [hostname], config).get(hostname)
+    if cid:
         if verbose:
             print(f"[+] Client ID found: {cid}")
     else:
@@ -72,11 +301,13 @@ def run_artifact(hostname, artifact_name, config=None, artifact_parameters=None,
             artifacts=Artifact_Name) 
         AS Flow FROM scope()"""
     
+    # Each call must launch a new collection, so never use the
+    # result cache here.
     if artifact_parameters:
-        meta = DataFrameQuery(start_artifact_query, config=config,
+        meta = DataFrameQuery(start_artifact_query, config=config, cache=False,
                               CID=cid, Artifact_Name=artifact_name, **artifact_parameters)
     else:
-        meta = DataFrameQuery(start_artifact_query, config=config,
+        meta = DataFrameQuery(start_artifact_query, config=config, cache=False,
                               CID=cid, Artifact_Name=artifact_name)
 
     if verbose:
@@ -100,7 +331,6 @@ def run_artifact(hostname, artifact_name, config=None, artifact_parameters=None,
         print(f"[+] Got artifact flow ID: {flow_id}")
 
     # GETTING RESPONSE ACTUAL DATA
-    response_df = pd.DataFrame()
     if not artifact_collect_name:
         artifact_collect_name = artifact_name
     vql = f"""
@@ -121,19 +351,24 @@ def run_artifact(hostname, artifact_name, config=None, artifact_parameters=None,
                 .replace("CID",f'"{cid}"')\
                 .replace("Flow_ID", f'"{flow_id}"'),"\n")
 
+    if verbose:
+        print("[!] Artifact is running... waiting for flow completion")
+
+    # Block until the server tells us the flow is done, then fetch the
+    # results exactly once.
     now = time.time()
-    delay = 0
-    while response_df.empty and delay < timeout:
-        if verbose:
-            print(f"[!] Artifact is running... {round(delay,2)}s")
-    
-        response_df = pd.DataFrame(DataFrameQuery(vql, Artifact_Name=artifact_collect_name, 
+    state = wait_for_flow(cid, flow_id, config=config, timeout=timeout)
+    delay = time.time() - now
+
+    if state is not None:
+        if state != "FINISHED":
+            print(f"[-] Flow ended in state {state}... Results may be incomplete!")
+
+        response_df = pd.DataFrame(DataFrameQuery(vql, config=config,
+                                                  Artifact_Name=artifact_collect_name,
                                                   CID=cid, Flow_ID=flow_id))
-        
-        time.sleep(5)
         delay = time.time() - now
-    
-    if delay < timeout:
+
         if verbose:
             print(f"[+] Done! {round(delay,2)}s\n")
         return response_df
@@ -146,3 +381,129 @@ def run_artifact(hostname, artifact_name, config=None, artifact_parameters=None,
                 .replace("CID",f'"{cid}"')\
                 .replace("Flow_ID", f'"{flow_id}"'),"\n")
         return None
+
+
+COLLECT_CLIENTS_QUERY = """
+    SELECT * FROM foreach(row=parse_json_array(data=ClientIds), query={
+      SELECT _value AS ClientId,
+             collect_client(client_id=_value, artifacts=Artifact_Name).flow_id AS FlowId
+      FROM scope()
+    })"""
+
+
+def run_artifact_multi(hostnames, artifact_name, config=None, artifact_parameters=None, limit=None, artifact_collect_name=None, verbose=True, timeout=600, workers=8, cache=None):
+    """
+    # [Instantiates artifact on many hostnames at once and returns the merged results as a pandas DataFrame]
+    # All hostnames are resolved in one query, all collections are
+    # launched in one query and completion of all flows is tracked by a
+    # single event subscription. Results are fetched as each host finishes.
+    # Examples:
+
+    # >>> df = wrappers.run_artifact_multi(["HOST1", "HOST2"], "Windows.System.Pslist")
+
+    # [+] Resolved 2/2 hostnames
+    # [+] Launched 2 collections
+    # [+] HOST2 (C.869eb611eaa5b899) FINISHED - 1/2
+    # [+] HOST1 (C.4f5e52adf0a337a9) FINISHED - 2/2
+    # [+] Done! 9.8s
+
+    # Returns:
+    #     [pandas.DataFrame]: [Results of all hosts with ClientId and Hostname columns added.]
+    """
+    if config is None:
+        config = LoadConfigFile()
+
+    if not artifact_collect_name:
+        artifact_collect_name = artifact_name
+
+    vql = """
+        SELECT * FROM source(
+            artifact=Artifact_Name,
+            client_id=CID,
+            flow_id=Flow_ID)"""
+    if limit:
+        try:
+            vql += f"\n\tLIMIT {int(limit)}"
+        except ValueError:
+            print("[-] Incorrect 'limit' value... Should be integer!")
+            return None
+
+    # FINDING ALL CLIENT_IDS IN ONE QUERY
+    resolved = _resolve(cache, hostnames, config)
+    names = set(hostnames)
+    missing = set(x for x in names if not resolved.get(x))
+    if verbose:
+        print(f"[+] Resolved {len(names) - len(missing)}/{len(names)} hostnames")
+
+    # Several names (e.g. a short name and the FQDN) may resolve to the
+    # same client, which is only collected once under the first name.
+    hosts = {}
+    for hostname in hostnames:
+        cid = resolved.get(hostname)
+        if cid:
+            hosts.setdefault(cid, hostname)
+
+    if missing:
+        print("[-] Cannot find any Client ID for:", ", ".join(sorted(missing)))
+
+    if not hosts:
+        return None
+
+    # LAUNCHING ALL COLLECTIONS IN ONE QUERY
+    meta = DataFrameQuery(COLLECT_CLIENTS_QUERY, config=config, cache=False,
+                          ClientIds=json.dumps(list(hosts)),
+                          Artifact_Name=artifact_name,
+                          **(artifact_parameters or {}))
+    flows = [(cid, flow_id) for cid, flow_id in zip(
+        meta.get("ClientId", []), meta.get("FlowId", [])) if flow_id]
+    if not flows:
+        print("[-] Artifact not instantiated... Check validity of name or parameters!")
+        return None
+
+    if verbose:
+        print(f"[+] Launched {len(flows)} collections")
+
+    clients_by_flow = {flow_id: cid for cid, flow_id in flows}
+
+    def fetch(flow_id):
+        cid = clients_by_flow[flow_id]
+        df = pd.DataFrame(DataFrameQuery(vql, config=config,
+                                         Artifact_Name=artifact_collect_name,
+                                         CID=cid, Flow_ID=flow_id))
+        # Some artifacts (e.g. Generic.Client.Info) already have these.
+        if "Hostname" not in df.columns:
+            df.insert(0, "Hostname", hosts[cid])
+        if "ClientId" not in df.columns:
+            df.insert(0, "ClientId", cid)
+        return df
+
+    # TRACKING ALL FLOWS TOGETHER - results are fetched as soon as
+    # each host finishes.
+    now = time.time()
+    results = []
+    with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+        for flow_id, state in wait_for_flows(flows, config=config, timeout=timeout):
+            results.append((flow_id, pool.submit(fetch, flow_id)))
+            if verbose:
+                cid = clients_by_flow[flow_id]
+                print(f"[+] {hosts[cid]} ({cid}) {state} - {len(results)}/{len(flows)}")
+
+    # A host whose results can not be fetched does not lose the others.
+    frames = []
+    for flow_id, future in results:
+        try:
+            frames.append(future.result())
+        except Exception as e:
+            cid = clients_by_flow[flow_id]
+            print(f"[-] Failed to fetch results of {hosts[cid]} ({cid}): {e}")
+    delay = time.time() - now
+
+    if len(results) < len(flows):
+        print(f"[-] Reached timeout ({timeout}s) with {len(flows) - len(results)} flows still running!")
+    elif verbose:
+        print(f"[+] Done! {round(delay,2)}s\n")
+
+    if not frames:
+        return None
+
+    return pd.concat(frames, ignore_index=True)
@@ -32,6 +32,10 @@ setuptools.setup(
         "pyyaml>=6",
         "cryptography>=46.0.7",
     ],
+    extras_require={
+        # A faster JSON decoder for query results.
+        "fast": ["orjson"],
+    },
     entry_points="""
 
     [console_scripts]
@@ -0,0 +1,49 @@
+import pytest
+
+from pyvelociraptor import client
+from pyvelociraptor import fake_server
+
+
+# Not a multiple of the chunk sizes used in the tests, so the last
+# read is short.
+FILE_SIZE = 3 * 1024 * 1024 + 1000
+
+
+@pytest.fixture(scope="session")
+def server():
+    with fake_server.FakeServer(rows=1000, batch_size=100,
+                                file_size=FILE_SIZE) as server:
+        yield server
+
+    client.CloseClients()
+
+
+@pytest.fixture(autouse=True)
+def reset_server(request):
+    # Tests change the injected failures, so start each one clean.
+    if "server" not in request.fixturenames:
+        yield
+        return
+
+    servicer = request.getfixturevalue("server").servicer
+    yield
+    servicer.error_rate = 0
+    servicer.straggler_rate = 0
+    servicer.straggler_latency = 1
+    servicer.file_size = FILE_SIZE
+
+
+@pytest.fixture
+def file_size(server):
+    return server.servicer.file_size
+
+
+@pytest.fixture
+def expected(file_size):
+    # The content of every file the fake server serves.
+    return fake_server.ExpectedData(0, file_size)
+
+
+@pytest.fixture
+def stub(server):
+    return client.GetClient(server.config, profile="bulk-download").stub()
@@ -0,0 +1,96 @@
+import os
+import time
+
+from pyvelociraptor import cache
+from pyvelociraptor import velo_pandas
+
+
+COLUMNS = {"Pid": [1, 2, 3], "Name": ["a", "b", "c"]}
+
+
+def test_result_cache_round_trip(tmp_path):
+    result_cache = cache.ResultCache(str(tmp_path))
+    result_cache.Set("key", COLUMNS, types={"Pid": "int"})
+
+    assert result_cache.Get("key") == COLUMNS
+    assert result_cache.GetWithTypes("key") == (COLUMNS, {"Pid": "int"})
+    assert result_cache.Get("missing") is None
+
+
+def test_result_cache_ttl(tmp_path, monkeypatch):
+    result_cache = cache.ResultCache(str(tmp_path), ttl=10)
+    result_cache.Set("key", COLUMNS)
+    result_cache.Set("forever", COLUMNS, ttl=0)
+
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + 20)
+    assert result_cache.Get("key") is None
+    assert result_cache.Get("forever") == COLUMNS
+    assert not os.path.exists(result_cache._filename("key"))
+
+
+def test_result_cache_evicts_least_recently_used(tmp_path):
+    result_cache = cache.ResultCache(str(tmp_path))
+    result_cache.Set("a", COLUMNS)
+    result_cache.Set("b", COLUMNS)
+
+    # a was written first but read last.
+    now = time.time()
+    os.utime(result_cache._filename("a"), (now - 200, now - 200))
+    os.utime(result_cache._filename("b"), (now - 100, now - 100))
+    result_cache.Get("a")
+
+    result_cache.max_bytes = 2 * os.path.getsize(result_cache._filename("a"))
+    result_cache.Set("c", COLUMNS)
+
+    assert result_cache.Get("a") == COLUMNS
+    assert result_cache.Get("b") is None
+    assert result_cache.Get("c") == COLUMNS
+
+
+def test_result_cache_invalidate_and_clear(tmp_path):
+    result_cache = cache.ResultCache(str(tmp_path))
+    result_cache.Set("a", COLUMNS)
+    result_cache.Set("b", COLUMNS)
+
+    result_cache.Invalidate("a")
+    assert result_cache.Get("a") is None
+    assert result_cache.Get("b") == COLUMNS
+
+    result_cache.Clear()
+    assert result_cache.Get("b") is None
+
+
+def test_dataframe_query_uses_cache(server, tmp_path):
+    result_cache = cache.ResultCache(str(tmp_path))
+    calls = server.servicer.query_count
+
+    first = velo_pandas.DataFrameQuery("SELECT * FROM info()",
+                                       config=server.config,
+                                       cache=result_cache)
+    second = velo_pandas.DataFrameQuery("SELECT * FROM info()",
+                                        config=server.config,
+                                        cache=result_cache, typed=True)
+
+    assert server.servicer.query_count == calls + 1
+    assert first["Pid"] == list(range(1000))
+    assert list(second["Pid"]) == list(range(1000))
+
+    velo_pandas.DataFrameQuery("SELECT * FROM info()", config=server.config,
+                               cache=False)
+    assert server.servicer.query_count == calls + 2
+
+
+def test_enable_cache(server, tmp_path):
+    velo_pandas.EnableCache(str(tmp_path))
+    try:
+        calls = server.servicer.query_count
+        velo_pandas.DataFrameQuery("x", config=server.config)
+        velo_pandas.DataFrameQuery("x", config=server.config)
+        assert server.servicer.query_count == calls + 1
+
+        velo_pandas.InvalidateCache("x", config=server.config)
+        velo_pandas.DataFrameQuery("x", config=server.config)
+        assert server.servicer.query_count == calls + 2
+    finally:
+        velo_pandas.DisableCache()
@@ -0,0 +1,62 @@
+import grpc
+import pytest
+
+from pyvelociraptor import client
+
+
+def test_profile_precedence():
+    config = dict(transport_profile="interactive")
+
+    assert client._Profile({})[0] == "default"
+    assert client._Profile(config)[0] == "interactive"
+    assert client._Profile(config, "bulk-download")[0] == "bulk-download"
+
+
+def test_config_overrides_profile_settings():
+    config = dict(transport_profile="bulk-download",
+                  transport_compression="gzip",
+                  transport_options={"grpc.max_receive_message_length": 1024,
+                                     "grpc.enable_retries": 0})
+    name, options, compression = client._Profile(config)
+
+    assert name == "bulk-download"
+    assert options["grpc.max_receive_message_length"] == 1024
+    assert options["grpc.enable_retries"] == 0
+    assert options["grpc.http2.bdp_probe"] == 1
+    assert compression == "gzip"
+    assert client.ChannelCompression(config) == grpc.Compression.Gzip
+
+    # The profile itself is not changed.
+    assert client.PROFILES["bulk-download"]["options"][
+        "grpc.max_receive_message_length"] == 256 * 1024 * 1024
+
+
+def test_unknown_profile():
+    with pytest.raises(ValueError):
+        client._Profile({}, "fast")
+
+    with pytest.raises(ValueError):
+        client._Profile(dict(transport_profile="fast"))
+
+
+def test_channel_options():
+    options = dict(client.ChannelOptions({}, "long-lived-events"))
+
+    assert options["grpc.ssl_target_name_override"] == "VelociraptorServer"
+    assert options["grpc.keepalive_time_ms"] == 300000
+
+
+def test_get_client_default_profile(server):
+    shared = client.GetClient(server.config, default_profile="bulk-download")
+    assert shared.profile == "bulk-download"
+    assert client.GetClient(server.config,
+                            default_profile="bulk-download") is shared
+
+    # The config's transport_profile wins over the caller's default.
+    config = dict(server.config, transport_profile="interactive")
+    interactive = client.GetClient(config, default_profile="bulk-download")
+    assert interactive.profile == "interactive"
+    assert interactive is not shared
+
+    assert client.GetClient(interactive) is interactive
+    assert client.GetClient(config, profile="default").profile == "default"
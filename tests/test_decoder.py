@@ -0,0 +1,125 @@
+import json
+import pickle
+
+import pytest
+
+from pyvelociraptor import api_pb2
+from pyvelociraptor import decoder
+
+
+@pytest.fixture(autouse=True)
+def restore_backend():
+    backend = decoder.Backend()
+    yield
+    decoder.SetBackend(backend)
+
+
+def response(rows, columns=None):
+    return api_pb2.VQLResponse(Response=json.dumps(rows),
+                               Columns=columns or list(rows[0]))
+
+
+@pytest.mark.parametrize("name", ["json", "orjson"])
+def test_backends_decode_the_same(name):
+    pytest.importorskip(name)
+    rows = [dict(Pid=1, Name="a", Details=dict(Ppid=4, Tags=["x", "y"]))]
+
+    decoder.SetBackend(name)
+    assert decoder.Backend() == name
+    assert decoder.DecodeResponse(response(rows)) == rows
+
+
+def test_orjson_falls_back_to_stdlib():
+    pytest.importorskip("orjson")
+    decoder.SetBackend("orjson")
+
+    # orjson rejects NaN, the standard library does not.
+    result = decoder.Loads('{"Value": NaN, "Big": 18446744073709551615}')
+    assert result["Value"] != result["Value"]
+    assert result["Big"] == 18446744073709551615
+
+
+def test_missing_backend_falls_back(monkeypatch):
+    def missing():
+        raise ImportError("not installed")
+
+    monkeypatch.setitem(decoder.BACKENDS, "orjson", missing)
+    monkeypatch.setitem(decoder.BACKENDS, "simdjson", missing)
+
+    assert decoder.SetBackend() == "json"
+    with pytest.raises(ImportError):
+        decoder.SetBackend("orjson")
+
+
+def test_unknown_backend():
+    with pytest.raises(ValueError):
+        decoder.SetBackend("yaml")
+
+
+def test_backend_from_environment(monkeypatch):
+    monkeypatch.setattr(decoder, "_backend", None)
+    monkeypatch.setenv("PYVELOCIRAPTOR_JSON", "json")
+
+    assert decoder.Backend() == "json"
+
+
+def test_decode_rows():
+    rows = [dict(Pid=1, Name="a", Details=dict(Ppid=4)),
+            dict(Pid=2, Name="b")]
+    result = decoder.DecodeRows(response(rows, ["Pid", "Name", "Details"]))
+
+    first, second = result
+    assert first["Name"] == first.Name == first[1] == "a"
+    assert first.get("Details") == dict(Ppid=4)
+    assert first.get("Missing", 5) == 5
+    assert second["Details"] is None
+    assert list(first.keys()) == ["Pid", "Name", "Details"]
+    assert first._asdict() == rows[0]
+    assert repr(second) == repr(dict(Pid=2, Name="b", Details=None))
+
+    # Rows of the same columns share one class.
+    assert type(first) is type(second)
+    assert type(first) is decoder.RowClass(["Pid", "Name", "Details"])
+
+
+def test_decode_rows_drops_unlisted_columns():
+    rows = [dict(Pid=1, Extra="x")]
+
+    row, = decoder.DecodeRows(response(rows, ["Pid"]))
+    assert row._asdict() == dict(Pid=1)
+
+    # Without Columns the keys of the first row are used.
+    row, = decoder.DecodeRows(api_pb2.VQLResponse(Response=json.dumps(rows)))
+    assert row.keys() == ("Pid", "Extra")
+
+
+def test_row_awkward_column_names():
+    rows = [{"class": 1, "keys": 2, "Has Space": 3}]
+    row, = decoder.DecodeRows(response(rows))
+
+    assert row["class"] == 1 and row["Has Space"] == 3
+    assert row["keys"] == 2
+    assert list(row.keys()) == ["class", "keys", "Has Space"]
+
+
+def test_row_pickles():
+    row, = decoder.DecodeRows(response([dict(Pid=1, Name="a")]))
+    copy = pickle.loads(pickle.dumps(row))
+
+    assert copy == row
+    assert copy.Name == "a"
+    assert type(copy) is type(row)
+
+
+def test_decode_rows_shares_strings():
+    rows = [dict(Name="svchost.exe", User=dict(Name="SYSTEM"))
+            for _ in range(3)]
+    strings = {}
+    first, second, _ = decoder.DecodeRows(response(rows), strings)
+
+    assert first.Name is second.Name
+    assert first.User["Name"] is second.User["Name"]
+
+    long = "x" * (decoder.MAX_SHARED_STRING + 1)
+    decoder.DecodeRows(response([dict(Name=long)]), strings)
+    assert long not in strings
@@ -0,0 +1,216 @@
+import io
+import os
+
+import grpc
+import pytest
+
+from pyvelociraptor import download
+from pyvelociraptor import fetch_flow_uploads
+
+
+CHUNK_SIZE = 256 * 1024
+
+
+class FailingStub:
+    """Passes the first `calls` reads to stub then fails."""
+
+    def __init__(self, stub, calls):
+        self.stub = stub
+        self.calls = calls
+
+    def VFSGetBuffer(self, request, **kw):
+        if self.calls <= 0:
+            raise IOError("Connection dropped")
+
+        self.calls -= 1
+        return self.stub.VFSGetBuffer(request, **kw)
+
+
+def test_fetch_positional(stub, tmp_path, expected, file_size):
+    path = tmp_path / "out"
+    with open(path, "wb") as outfd:
+        end = download.Downloader(stub, chunk_size=CHUNK_SIZE).Fetch(
+            ["file"], outfd)
+
+    assert end == file_size
+    assert path.read_bytes() == expected
+
+
+def test_fetch_in_order(stub, expected, file_size):
+    outfd = io.BytesIO()
+    end = download.Downloader(stub, chunk_size=CHUNK_SIZE).Fetch(
+        ["file"], outfd)
+
+    assert end == file_size
+    assert outfd.getvalue() == expected
+
+
+def test_fetch_in_order_bounds_buffered_chunks(server, stub, monkeypatch,
+                                               expected):
+    server.servicer.straggler_rate = 0.2
+    server.servicer.straggler_latency = 0.2
+
+    buffered = []
+    write = download._Writer.write
+
+    def record(writer, offset, data):
+        write(writer, offset, data)
+        buffered.append(sum(len(x) for x in writer.pending.values()))
+
+    monkeypatch.setattr(download._Writer, "write", record)
+
+    downloader = download.Downloader(stub, chunk_size=CHUNK_SIZE,
+                                     concurrency=4)
+    outfd = io.BytesIO()
+    downloader.Fetch(["file"], outfd)
+
+    assert outfd.getvalue() == expected
+    assert max(buffered) <= 2 * downloader.concurrency * CHUNK_SIZE
+
+
+def test_fetch_stops_at_size(stub, expected):
+    outfd = io.BytesIO()
+    end = download.Downloader(stub, chunk_size=CHUNK_SIZE).Fetch(
+        ["file"], outfd, size=CHUNK_SIZE * 2)
+
+    assert end == CHUNK_SIZE * 2
+    assert outfd.getvalue() == expected[:CHUNK_SIZE * 2]
+
+
+def test_fetch_retries_transient_errors(server, stub, expected):
+    server.servicer.error_rate = 0.3
+
+    downloader = download.Downloader(stub, chunk_size=CHUNK_SIZE,
+                                     retries=20, min_backoff=0.01)
+    outfd = io.BytesIO()
+    downloader.Fetch(["file"], outfd)
+
+    assert outfd.getvalue() == expected
+
+
+def test_fetch_does_not_retry_other_codes(server, stub):
+    server.servicer.error_rate = 1
+
+    downloader = download.Downloader(stub, chunk_size=CHUNK_SIZE,
+                                     retry_codes=[], min_backoff=0.01)
+    with pytest.raises(grpc.RpcError):
+        downloader.Fetch(["file"], io.BytesIO())
+
+    assert downloader.retried == 0
+
+
+def test_fetch_hedges_slow_reads(server, stub, expected):
+    server.servicer.straggler_rate = 1
+    server.servicer.straggler_latency = 0.2
+
+    downloader = download.Downloader(stub, chunk_size=1024 * 1024,
+                                     hedge_after=0.05)
+    outfd = io.BytesIO()
+    downloader.Fetch(["file"], outfd)
+
+    assert outfd.getvalue() == expected
+    assert downloader.hedged > 0
+
+
+def test_resume_fetches_only_missing_bytes(server, stub, tmp_path, expected,
+                                          file_size):
+    path = str(tmp_path / "out")
+    offset = CHUNK_SIZE * 5
+
+    with open(path, "wb") as outfd:
+        outfd.write(expected[:offset])
+
+    checkpoint = download.Checkpoint(path, ["file"])
+    checkpoint.offset = offset
+    checkpoint.Save()
+
+    calls = server.servicer.buffer_count
+    downloader = download.Downloader(stub, chunk_size=CHUNK_SIZE,
+                                     concurrency=1)
+    size, skipped = download.FetchResumable(downloader, ["file"], path,
+                                            size=file_size)
+
+    assert (size, skipped) == (file_size, False)
+    assert open(path, "rb").read() == expected
+    assert server.servicer.buffer_count - calls == \
+        -(-(file_size - offset) // CHUNK_SIZE)
+
+
+def test_resume_skips_complete_files(server, stub, tmp_path, file_size):
+    path = str(tmp_path / "out")
+    downloader = download.Downloader(stub, chunk_size=CHUNK_SIZE)
+    assert download.FetchResumable(downloader, ["file"], path) == \
+        (file_size, False)
+
+    calls = server.servicer.buffer_count
+    assert download.FetchResumable(downloader, ["file"], path) == \
+        (file_size, True)
+    assert server.servicer.buffer_count == calls
+
+
+def test_failed_fetch_saves_checkpoint(stub, tmp_path, expected, file_size):
+    path = str(tmp_path / "out")
+    downloader = download.Downloader(FailingStub(stub, 3),
+                                     chunk_size=CHUNK_SIZE, concurrency=1)
+
+    with pytest.raises(IOError):
+        download.FetchResumable(downloader, ["file"], path)
+
+    assert download.Checkpoint(path, ["file"]).offset == 3 * CHUNK_SIZE
+
+    downloader = download.Downloader(stub, chunk_size=CHUNK_SIZE)
+    assert download.FetchResumable(downloader, ["file"], path) == \
+        (file_size, False)
+    assert open(path, "rb").read() == expected
+
+
+def test_upload_fetcher_same_basename(stub, tmp_path, file_size):
+    fetcher = fetch_flow_uploads.UploadFetcher(
+        stub, str(tmp_path), None, chunk_size=CHUNK_SIZE, verbose=False)
+
+    for components in (["a", "index"], ["b", "index"], ["c", "index"]):
+        fetcher.Submit(components, size=file_size)
+
+    results = fetcher.Wait()
+    assert not [x.error for x in results if x.error]
+
+    files = {x.output_file for x in results}
+    assert len(files) == 3
+    for filename in files:
+        assert os.path.getsize(filename) == file_size
+
+
+def test_resume_refetches_when_size_changes(server, stub, tmp_path):
+    path = str(tmp_path / "out")
+    downloader = download.Downloader(stub, chunk_size=CHUNK_SIZE)
+
+    server.servicer.file_size = 300000
+    assert download.FetchResumable(downloader, ["file"], path,
+                                   size=300000) == (300000, False)
+
+    # The server now reports a different size for the same upload.
+    server.servicer.file_size = 400000
+    assert download.FetchResumable(downloader, ["file"], path,
+                                   size=400000) == (400000, False)
+    assert os.path.getsize(path) == 400000
+
+
+def test_upload_fetcher_counts_only_fetched_bytes(stub, tmp_path, expected,
+                                                  file_size):
+    offset = CHUNK_SIZE * 4
+    path = str(tmp_path / "index")
+    with open(path, "wb") as outfd:
+        outfd.write(expected[:offset])
+
+    checkpoint = download.Checkpoint(path, ["a", "index"])
+    checkpoint.offset = offset
+    checkpoint.Save()
+
+    fetcher = fetch_flow_uploads.UploadFetcher(
+        stub, str(tmp_path), None, chunk_size=CHUNK_SIZE, verbose=False)
+    fetcher.Submit(["a", "index"], size=file_size)
+    status, = fetcher.Wait()
+
+    assert status.size == file_size
+    assert status.fetched == file_size - offset
+    assert fetcher.Stats()[1] == file_size - offset
@@ -0,0 +1,49 @@
+import csv
+import json
+
+from pyvelociraptor import sinks
+
+
+def rows(start, count, **extra):
+    return [dict(Idx=i, Name="row %d" % i, **extra)
+            for i in range(start, start + count)]
+
+
+def test_jsonl_rolls_over_on_rows(tmp_path):
+    with sinks.Open(str(tmp_path / "out.jsonl"), max_rows=250) as sink:
+        for start in range(0, 1000, 100):
+            sink.Write(rows(start, 100), ["Idx", "Name"])
+
+    # Files roll over after the batch which reaches max_rows.
+    assert [f.rsplit("/", 1)[1] for f in sink.files] == [
+        "out-00000.jsonl", "out-00001.jsonl",
+        "out-00002.jsonl", "out-00003.jsonl"]
+    assert sink.total_rows == 1000
+
+    result = []
+    for filename in sink.files:
+        with open(filename) as fd:
+            result.extend(json.loads(line)["Idx"] for line in fd)
+
+    assert result == list(range(1000))
+
+
+def test_jsonl_rolls_over_on_bytes(tmp_path):
+    with sinks.Open(str(tmp_path / "out.jsonl"), max_bytes=1000) as sink:
+        for start in range(0, 100, 10):
+            sink.Write(rows(start, 10), ["Idx", "Name"])
+
+    assert len(sink.files) > 1
+    assert sink.total_rows == 100
+
+
+def test_csv_starts_new_file_when_columns_change(tmp_path):
+    with sinks.Open(str(tmp_path / "out.csv")) as sink:
+        sink.Write(rows(0, 5), ["Idx", "Name"])
+        sink.Write(rows(5, 5, Extra=1), ["Idx", "Name", "Extra"])
+
+    assert len(sink.files) == 2
+    with open(sink.files[1]) as fd:
+        reader = csv.reader(fd)
+        assert next(reader) == ["Idx", "Name", "Extra"]
+        assert len(list(reader)) == 5
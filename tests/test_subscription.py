@@ -0,0 +1,81 @@
+import threading
+import time
+
+import pytest
+
+from pyvelociraptor import subscription
+
+
+def wait_for(condition, timeout=10):
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() > deadline:
+            raise AssertionError("Timed out waiting")
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def run():
+    threads = []
+
+    def start(sub):
+        thread = threading.Thread(target=sub.Run)
+        thread.start()
+        threads.append((sub, thread))
+        return sub
+
+    yield start
+
+    for sub, thread in threads:
+        sub.Stop()
+        thread.join(10)
+
+
+def test_reconnects_when_the_stream_ends(server, run):
+    logs = []
+    sub = run(subscription.Subscription(
+        "SELECT * FROM watch_monitoring()", lambda row: None,
+        config=server.config, min_backoff=0.01, max_backoff=0.05,
+        log=logs.append))
+
+    # The fake server ends the stream after its 1000 rows.
+    wait_for(lambda: sub.Stats()["reconnects"] >= 2)
+    assert sub.Stats()["rows_received"] >= 2000
+    assert sub.last_timestamp > 0
+    assert any("reconnecting" in x for x in logs)
+
+    # On reconnect the query can tell where it left off.
+    request = sub._Request()
+    env = {x.key: x.value for x in request.env}
+    assert float(env["LastTimestamp"]) == sub.last_timestamp / 1000000
+
+
+def test_full_queue_stops_reading(server, run):
+    release = threading.Event()
+    sub = run(subscription.Subscription(
+        "SELECT * FROM watch_monitoring()", lambda row: release.wait(),
+        config=server.config, workers=1, queue_size=5, log=None))
+
+    time.sleep(0.5)
+    stats = sub.Stats()
+
+    # Only the first batch of 100 rows was read from the stream.
+    assert stats["rows_received"] == 100
+    assert stats["rows_handled"] == 0
+
+    release.set()
+    wait_for(lambda: sub.Stats()["rows_handled"] >= 1000)
+
+
+def test_handler_errors_are_logged(server, run):
+    logs = []
+
+    def handler(row):
+        raise KeyError("Name")
+
+    sub = run(subscription.Subscription(
+        "SELECT * FROM watch_monitoring()", handler, config=server.config,
+        log=logs.append))
+
+    wait_for(lambda: sub.Stats()["errors"] >= 10)
+    assert "Handler failed: KeyError: 'Name'" in logs
@@ -0,0 +1,92 @@
+import io
+import time
+
+import grpc
+import pytest
+
+from pyvelociraptor import api_pb2
+from pyvelociraptor import client
+from pyvelociraptor import download
+from pyvelociraptor import telemetry
+from pyvelociraptor import velo_pandas
+
+
+@pytest.fixture
+def collector():
+    collector = telemetry.Collector()
+    telemetry.Enable(collector)
+    yield collector
+    telemetry.RemoveCallback(collector)
+
+
+@pytest.fixture
+def instrumented(server, collector):
+    # Only channels opened after Enable() are intercepted.
+    with client.Client(server.config) as instrumented:
+        yield instrumented
+
+
+def totals(collector, method):
+    return collector.methods["/proto.API/" + method]
+
+
+def test_query_stats(collector, instrumented):
+    velo_pandas.DataFrameQuery("x", config=instrumented, cache=False)
+
+    query = totals(collector, "Query")
+    assert query["calls"] == 1
+    assert query["errors"] == query["cancelled"] == 0
+    assert query["batches"] == 10
+    assert query["rows"] == 1000
+    assert query["bytes"] > 0
+    assert query["decode_time"] > 0
+
+
+def test_cancelled_stream_is_not_an_error(collector, instrumented):
+    call = instrumented.stub().Query(velo_pandas.QueryRequest("x"))
+    next(call)
+    call.cancel()
+
+    query = totals(collector, "Query")
+    assert query["calls"] == 1
+    assert query["cancelled"] == 1
+    assert query["errors"] == 0
+
+
+def test_hedged_losers_are_cancelled(server, collector, instrumented):
+    server.servicer.straggler_rate = 1
+    server.servicer.straggler_latency = 0.2
+
+    calls = server.servicer.buffer_count
+    downloader = download.Downloader(instrumented.stub(),
+                                     chunk_size=1024 * 1024, hedge_after=0.05)
+    downloader.Fetch(["file"], io.BytesIO())
+
+    # Cancelled calls may be reported from another thread.
+    reads = totals(collector, "VFSGetBuffer")
+    for _ in range(100):
+        if reads["calls"] == server.servicer.buffer_count - calls:
+            break
+        time.sleep(0.01)
+
+    assert downloader.hedged > 0
+    assert reads["calls"] == server.servicer.buffer_count - calls
+    assert reads["errors"] == 0
+    assert reads["cancelled"] > 0
+
+
+def test_failed_calls_are_errors(server, collector, instrumented):
+    server.servicer.error_rate = 1
+
+    with pytest.raises(grpc.RpcError):
+        instrumented.stub().VFSGetBuffer(api_pb2.VFSFileBuffer(length=10))
+
+    reads = totals(collector, "VFSGetBuffer")
+    assert reads["errors"] == 1
+    assert reads["cancelled"] == 0
+
+    text = collector.PrometheusText()
+    assert ('pyvelociraptor_client_errors_total'
+            '{method="/proto.API/VFSGetBuffer"} 1') in text
+    assert "pyvelociraptor_client_cancelled_total" in text
+    assert "VFSGetBuffer" in collector.Summary()
@@ -0,0 +1,185 @@
+import json
+
+import pytest
+
+from pyvelociraptor import api_pb2
+from pyvelociraptor import client
+from pyvelociraptor import replay
+from pyvelociraptor import velo_pandas
+
+
+def make_responses(*sizes):
+    responses = []
+    idx = 0
+    for size in sizes:
+        rows = [dict(Idx=idx + i, Name="row %d" % (idx + i))
+                for i in range(size)]
+        idx += size
+        responses.append(api_pb2.VQLResponse(
+            Response=json.dumps(rows), Columns=["Idx", "Name"]))
+
+    return responses
+
+
+def test_response_chunks_regroups_batches():
+    chunks = list(velo_pandas.ResponseChunks(make_responses(10, 3, 25), 7))
+
+    assert [len(x["Idx"]) for x in chunks] == [7, 7, 7, 7, 7, 3]
+    assert sum((x["Idx"] for x in chunks), []) == list(range(38))
+
+
+def test_response_chunks_per_batch():
+    chunks = list(velo_pandas.ResponseChunks(make_responses(10, 3, 25)))
+
+    assert [len(x["Idx"]) for x in chunks] == [10, 3, 25]
+
+
+def test_dataframe_query(server):
+    result = velo_pandas.DataFrameQuery("SELECT * FROM info()",
+                                        config=server.config, cache=False)
+
+    assert len(result["Pid"]) == 1000
+    assert result["Pid"] == list(range(1000))
+
+
+def test_replay_matches_request(server, tmp_path):
+    path = str(tmp_path / "recording.vqlr")
+    recorder = replay.RecordingClient(path, server.config)
+    velo_pandas.DataFrameQuery("x", config=recorder, cache=False)
+    velo_pandas.DataFrameQuery("y", config=recorder, cache=False, max_row=500)
+
+    player = replay.ReplayClient(path)
+    result = velo_pandas.DataFrameQuery("x", config=player, cache=False)
+    assert len(result["Pid"]) == 1000
+
+    call = player.stub().Query(velo_pandas.QueryRequest("y", max_row=500))
+    assert len(list(call)) == 2
+    call.cancel()
+
+
+def test_recorded_query_can_be_cancelled(server, tmp_path):
+    recorder = replay.RecordingClient(str(tmp_path / "r.vqlr"), server.config)
+    call = recorder.stub().Query(velo_pandas.QueryRequest("x"))
+
+    next(call)
+    call.cancel()
+
+
+class StaticClient(client.Client):
+    """Answers every Query with a fixed list of responses."""
+
+    def __init__(self, responses):
+        self.config = dict(api_connection_string="static:")
+        self.responses = responses
+
+    def stub(self):
+        return self
+
+    def Query(self, request, **kw):
+        return iter(self.responses)
+
+
+def named_response(name, rows):
+    return api_pb2.VQLResponse(
+        Response=json.dumps(rows), Columns=list(rows[0]),
+        Query=api_pb2.VQLRequest(Name=name))
+
+
+def test_multi_query_demultiplexes_interleaved_batches():
+    responses = [named_response("a", [dict(Idx=0)]),
+                 named_response("b", [dict(Name="x"), dict(Name="y")]),
+                 api_pb2.VQLResponse(log="a log message"),
+                 named_response("a", [dict(Idx=1), dict(Idx=2)])]
+
+    result = velo_pandas.DataFrameMultiQuery(
+        dict(a="SELECT 1", b="SELECT 2", c="SELECT 3"),
+        config=StaticClient(responses))
+
+    assert result == dict(a=dict(Idx=[0, 1, 2]), b=dict(Name=["x", "y"]),
+                          c={})
+
+    batches = list(velo_pandas.MultiQueryIterator(
+        dict(a="SELECT 1", b="SELECT 2"), config=StaticClient(responses)))
+    assert [name for name, _ in batches] == ["a", "b", "a"]
+
+
+def test_multi_query_against_server(server):
+    queries = dict(Processes="SELECT * FROM pslist()",
+                   Info="SELECT * FROM info()")
+    request = velo_pandas.MultiQueryRequest(queries)
+    assert [x.Name for x in request.Query] == ["Processes", "Info"]
+
+    result = velo_pandas.DataFrameMultiQuery(queries, config=server.config)
+    assert set(result) == set(queries)
+    for columns in result.values():
+        assert columns["Pid"] == list(range(1000))
+
+
+def test_query_rows(server):
+    rows = list(velo_pandas.QueryRows("SELECT * FROM pslist()",
+                                      config=server.config))
+
+    assert len(rows) == 1000
+    assert [x.Pid for x in rows] == list(range(1000))
+    assert rows[0].keys() == tuple(rows[0]._asdict())
+    assert rows[0].Name is rows[-1].Name
+
+
+@pytest.fixture
+def pandas():
+    return pytest.importorskip("pandas")
+
+
+def test_convert_columns(pandas):
+    columns = dict(Pid=[1, 2, None], Size=[1, 2.5, None], Hidden=[True, False],
+                   Time=[0, 86400], Name=["a", "b", "a", "a"],
+                   Unique=["a", "b"], Mixed=[1, "2"])
+    types = dict(Pid="int", Size="float64", Hidden="bool", Time="timestamp",
+                 Mixed="int64", Name=None)
+    result = velo_pandas.ConvertColumns(columns, types)
+
+    assert str(result["Pid"].dtype) == "Int64"
+    assert result["Pid"][2] is pandas.NA
+    assert result["Size"].dtype == "float64"
+    assert result["Size"][2] != result["Size"][2]
+    assert result["Hidden"].dtype == bool
+    assert list(result["Time"]) == [
+        pandas.Timestamp("1970-01-01", tz="UTC"),
+        pandas.Timestamp("1970-01-02", tz="UTC")]
+    assert isinstance(result["Name"], pandas.Categorical)
+    assert result["Unique"] == ["a", "b"]
+    assert result["Mixed"] == [1, "2"]
+
+    frame = pandas.DataFrame(dict(Hidden=result["Hidden"], Time=result["Time"]))
+    assert frame["Hidden"].sum() == 1
+    assert frame["Time"].dt.day.tolist() == [1, 2]
+
+
+def test_convert_columns_checks_value_types(pandas):
+    columns = dict(Pid=[1.5, 2], Hidden=["false"], Time=["not a time"])
+    types = dict(Pid="int", Hidden="bool", Time="timestamp")
+
+    assert velo_pandas.ConvertColumns(columns, types) == columns
+    assert velo_pandas.ConvertColumns(
+        dict(Name=["a", "a"]), categorical=None) == dict(Name=["a", "a"])
+
+
+def test_response_types():
+    responses = [api_pb2.VQLResponse(types=[
+        api_pb2.VQLTypeMap(column="Pid", type="int")])]
+    types = {}
+
+    assert list(velo_pandas.ResponseTypes(responses, types)) == responses
+    assert types == dict(Pid="int")
+
+
+def test_typed_dataframe_query(server, pandas):
+    result = velo_pandas.DataFrameQuery("SELECT * FROM pslist()",
+                                        config=server.config, cache=False,
+                                        typed=True)
+
+    assert result["Pid"].dtype == "int64"
+    assert list(result["Pid"]) == list(range(1000))
+    assert pandas.api.types.is_datetime64_any_dtype(result["CreateTime"])
+    assert result["CreateTime"][0] == pandas.Timestamp("2024-01-01", tz="UTC")
+    assert isinstance(result["Name"], pandas.Categorical)
@@ -0,0 +1,90 @@
+import json
+import time
+
+from pyvelociraptor import wrappers
+
+
+class FakeQueries:
+    """Answers wrappers' DataFrameQuery calls from a dict of results."""
+
+    def __init__(self, results):
+        self.results = results
+        self.calls = []
+
+    def __call__(self, query, **kw):
+        self.calls.append((query, kw))
+        for marker, result in self.results.items():
+            if marker in query:
+                return result(kw) if callable(result) else result
+
+        return {}
+
+
+def test_client_id_cache_ttl(server, monkeypatch):
+    cache = wrappers.ClientIdCache(ttl=10)
+    cache.update({"Host1": "C.1"}, config=server.config)
+
+    assert cache.get("host1", config=server.config) == "C.1"
+
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + 20)
+    assert cache.get("host1", config=server.config) is None
+
+
+def test_client_id_cache_persists(server, tmp_path):
+    path = str(tmp_path / "clients.json")
+    wrappers.ClientIdCache(path=path).update({"Host1": "C.1"},
+                                              config=server.config)
+
+    cache = wrappers.ClientIdCache(path=path)
+    assert cache.get("HOST1", config=server.config) == "C.1"
+
+    cache.invalidate("host1", config=server.config)
+    assert wrappers.ClientIdCache(path=path).get(
+        "host1", config=server.config) is None
+
+
+def test_client_id_cache_resolves_missing_in_one_query(server, monkeypatch):
+    queries = FakeQueries({"clients(search": lambda kw: dict(
+        Hostname=json.loads(kw["Hostnames"]), client_id=["C.2", "C.3"])})
+    monkeypatch.setattr(wrappers, "DataFrameQuery", queries)
+
+    cache = wrappers.ClientIdCache()
+    cache.update({"Host1": "C.1"}, config=server.config)
+    result = cache.resolve(["Host1", "Host2", "Host3"], config=server.config)
+
+    assert result == {"Host1": "C.1", "Host2": "C.2", "Host3": "C.3"}
+    assert len(queries.calls) == 1
+    assert json.loads(queries.calls[0][1]["Hostnames"]) == ["Host2", "Host3"]
+    assert queries.calls[0][1]["cache"] is False
+
+    # Now answered from the cache.
+    cache.resolve(["Host2"], config=server.config)
+    assert len(queries.calls) == 1
+
+
+def test_run_artifact_multi_names_of_same_client(server, monkeypatch,
+                                                 capsys):
+    queries = FakeQueries({
+        "clients(search": dict(Hostname=["host1", "host1.example.com"],
+                               client_id=["C.1", "C.1"]),
+        "collect_client": lambda kw: dict(
+            ClientId=json.loads(kw["ClientIds"]), FlowId=["F.1"]),
+        "source(": dict(Pid=[1, 2]),
+    })
+    monkeypatch.setattr(wrappers, "DataFrameQuery", queries)
+    monkeypatch.setattr(wrappers, "wait_for_flows",
+                        lambda flows, **kw: iter([("F.1", "FINISHED")]))
+
+    df = wrappers.run_artifact_multi(["host1", "host1.example.com"],
+                                     "Generic.Client.Info",
+                                     config=server.config, cache=False)
+
+    out = capsys.readouterr().out
+    assert "Cannot find" not in out
+    assert "Resolved 2/2" in out
+
+    collect = [kw for query, kw in queries.calls if "collect_client" in query]
+    assert json.loads(collect[0]["ClientIds"]) == ["C.1"]
+    assert list(df["Hostname"]) == ["host1", "host1"]
+    assert list(df["ClientId"]) == ["C.1", "C.1"]